@@ -1,24 +1,25 @@
 import csv
 import collections
 import math
-from bpe import apply_bpe, learn_bpe, tokenize_corpus, initialize_vocabulary
+from bpe import apply_bpe, learn_bpe_snapshots, tokenize_corpus, initialize_vocabulary
 from corpus import normalize_text, read_corpus
 
-def save_tokens_with_words(tokens, original_words, file_path):
+def save_tokens_with_words(bpe_codes, original_words, file_path):
     """
-    Saves tokens with their corresponding original words to a file.
+    Saves original words with their BPE tokens to a file.
 
     Args:
-        tokens (set): Set of tokens.
+        bpe_codes (list): List of BPE merge operations.
         original_words (iterable): Original words.
         file_path (str): Path to the output file.
 
     Returns:
         None
     """
+    original_words = list(original_words)
     with open(file_path, 'w', encoding='utf-8') as f:
-        for word in original_words:
-            tokenized_word = ' '.join(apply_bpe(word, tokens))
+        for word, word_tokens in zip(original_words, apply_bpe(original_words, bpe_codes)):
+            tokenized_word = ' '.join(word_tokens)
             f.write(f"{word}: {tokenized_word}\n")
 
 def save_matched_segmented_words(segmented_words, tokens, file_path):
@@ -67,6 +68,23 @@ def vocabulary_coverage(tokens, segmented_words):
     covered_words = [word for word in segmented_words if all(token in tokens for token in word.split())]
     return len(covered_words) / len(segmented_words)
 
+def log_scale_merges(max_merges):
+    """
+    Numbers of merges analysed on a log scale: the powers of two up to max_merges.
+
+    Args:
+        max_merges (int): Maximum number of merges.
+
+    Returns:
+        list: Numbers of merges.
+    """
+    steps = []
+    num_merges = 1
+    while num_merges <= max_merges:
+        steps.append(num_merges)
+        num_merges *= 2
+    return steps
+
 def analyze_coverage_log(word_freq, segmented_words, max_merges):
     """
     Analyzes coverage and compression over multiple merge steps.
@@ -80,15 +98,14 @@ def analyze_coverage_log(word_freq, segmented_words, max_merges):
         list: Coverage results.
     """
     coverage_results = []
-    num_merges = 1
-    while num_merges <= max_merges:
-        bpe_codes, final_vocab = learn_bpe(word_freq, num_merges)
-        tokens = tokenize_corpus(normalize_text(read_corpus('corpus.txt')), bpe_codes)
+    text = normalize_text(read_corpus('corpus.txt'))
+    original_vocab = initialize_vocabulary(word_freq)
+    for num_merges, bpe_codes, final_vocab in learn_bpe_snapshots(word_freq, log_scale_merges(max_merges)):
+        tokens = tokenize_corpus(text, bpe_codes)
         coverage = vocabulary_coverage(tokens, segmented_words)
-        compression_ratio = calculate_compression_ratio(initialize_vocabulary(word_freq), final_vocab)
+        compression_ratio = calculate_compression_ratio(original_vocab, final_vocab)
         coverage_results.append((num_merges, coverage, compression_ratio))
         print(f"Merges: {num_merges}, Coverage: {coverage:.2%}, Compression: {compression_ratio:.2f}")
-        num_merges *= 2
     return coverage_results
 
 def analyze_accuracy_log(word_freq, segmented_words, max_merges):
@@ -104,13 +121,10 @@ def analyze_accuracy_log(word_freq, segmented_words, max_merges):
         list: Accuracy results.
     """
     accuracy_results = []
-    num_merges = 1
-    while num_merges <= max_merges:
-        bpe_codes, _ = learn_bpe(word_freq, num_merges)
+    for num_merges, bpe_codes, _ in learn_bpe_snapshots(word_freq, log_scale_merges(max_merges)):
         accuracy = compare_tokens_with_segmented_words(bpe_codes, segmented_words)[1]
         accuracy_results.append((num_merges, accuracy))
         print(f"Merges: {num_merges}, Accuracy: {accuracy:.2%}")
-        num_merges *= 2
     return accuracy_results
 
 def save_results_to_csv(coverage_results, accuracy_results, file_path):
@@ -186,7 +200,7 @@ def segment_sentence(sentence, bpe_codes):
     """
     normalized_sentence = normalize_text(sentence)
     words = normalized_sentence.split()
-    segmented_sentence = [apply_bpe(word, bpe_codes) for word in words]
+    segmented_sentence = apply_bpe(words, bpe_codes)
     return segmented_sentence
 
 def compare_tokens_with_segmented_words(bpe_codes, segmented_words):
@@ -204,9 +218,9 @@ def compare_tokens_with_segmented_words(bpe_codes, segmented_words):
     correct_segmentations = []
     total_words = len(segmented_words)
     
-    for word in segmented_words:
-        original_word = word.replace(' ', '')
-        tokenized_word = ' '.join(apply_bpe(original_word, bpe_codes))
+    original_words = [word.replace(' ', '') for word in segmented_words]
+    for word, original_word, word_tokens in zip(segmented_words, original_words, apply_bpe(original_words, bpe_codes)):
+        tokenized_word = ' '.join(word_tokens)
         if tokenized_word == word:
             correct_segmentations.append(f"{original_word}: {tokenized_word}")
     
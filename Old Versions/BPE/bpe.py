@@ -1,5 +1,13 @@
-import re
+import os
+import sys
+import heapq
 import collections
+import functools
+
+# The applier is shared with UParser. Its directory goes last on the path, so that the modules of this
+# project with the same names as UParser's (main, analysis) are still the ones imported
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir, 'UParser'))
+from bpe_applier import BPEApplier
 
 def initialize_vocabulary(word_freq):
     """
@@ -14,41 +22,112 @@ def initialize_vocabulary(word_freq):
     vocab = {' '.join(word): freq for word, freq in word_freq.items()}
     return vocab
 
-def get_stats(vocab):
+def pair_offsets(symbols):
     """
-    Computes pair statistics for the given vocabulary.
+    Counts the symbol pairs of a word and finds where each first occurs.
 
     Args:
-        vocab (dict): Vocabulary with word frequencies.
+        symbols (list): Symbols of the word.
 
     Returns:
-        dict: Dictionary of symbol pairs and their frequencies.
+        collections.Counter: Occurrences of each pair.
+        dict: Character offset of the first occurrence of each pair.
     """
-    pairs = collections.defaultdict(int)
-    for word, freq in vocab.items():
-        symbols = word.split()
-        for i in range(len(symbols) - 1):
-            pairs[(symbols[i], symbols[i + 1])] += freq
-    return pairs
-
-def merge_vocab(pair, vocab):
+    counts = collections.Counter()
+    offsets = {}
+    offset = 0
+    for pair in zip(symbols, symbols[1:]):
+        counts[pair] += 1
+        offsets.setdefault(pair, offset)
+        offset += len(pair[0])
+    return counts, offsets
+
+def learn_bpe_snapshots(word_freq, steps):
     """
-    Merges the most frequent pair in the vocabulary.
+    Learns Byte Pair Encoding (BPE) in a single run, yielding the merge operations and the vocabulary
+    after each requested number of merges.
+
+    Pair counts are kept with a pair -> words index, so each merge only revisits the words that contain
+    the merged pair, and the most frequent pair is taken from a lazy priority queue. Among pairs of equal
+    frequency, the one occurring first in the vocabulary (by word, then by position) is merged.
 
     Args:
-        pair (tuple): The pair to merge.
-        vocab (dict): The current vocabulary.
+        word_freq (dict): Dictionary of word frequencies.
+        steps (iterable): Numbers of merge operations at which to take a snapshot.
 
-    Returns:
-        dict: Updated vocabulary with the pair merged.
+    Yields:
+        tuple: Number of merge operations, list of BPE merge operations learned so far (fewer if no pair
+        is left to merge) and vocabulary after those merges.
     """
-    new_vocab = {}
-    bigram = ' '.join(pair)
-    replacement = ''.join(pair)
-    for word in vocab:
-        new_word = re.sub(bigram, replacement, word)
-        new_vocab[new_word] = vocab[word]
-    return new_vocab
+    words = [list(word) for word in word_freq]
+    freqs = list(word_freq.values())
+    stats = collections.Counter()
+    indices = collections.defaultdict(set)
+    # Word index and character offset of the first occurrence of each pair
+    first = {}
+    for j, (symbols, freq) in enumerate(zip(words, freqs)):
+        counts, offsets = pair_offsets(symbols)
+        for pair, count in counts.items():
+            stats[pair] += count * freq
+            indices[pair].add(j)
+            first.setdefault(pair, (j, offsets[pair]))
+    heap = [(-count, first[pair], pair) for pair, count in stats.items()]
+    heapq.heapify(heap)
+
+    bpe_codes = []
+    for step in sorted(steps):
+        while len(bpe_codes) < step:
+            # Entries are pushed on every change and checked against the current state when popped
+            while heap and (-heap[0][0] != stats.get(heap[0][2]) or heap[0][1] != first.get(heap[0][2])):
+                heapq.heappop(heap)
+            if not heap:
+                break
+            best_pair = heapq.heappop(heap)[2]
+            bpe_codes.append(best_pair)
+            replacement = ''.join(best_pair)
+
+            changed = set()
+            stale = set()
+            for j in indices.pop(best_pair):
+                symbols, freq = words[j], freqs[j]
+                new_symbols = []
+                i = 0
+                while i < len(symbols):
+                    if i < len(symbols) - 1 and (symbols[i], symbols[i + 1]) == best_pair:
+                        new_symbols.append(replacement)
+                        i += 2
+                    else:
+                        new_symbols.append(symbols[i])
+                        i += 1
+                old_counts, _ = pair_offsets(symbols)
+                new_counts, new_offsets = pair_offsets(new_symbols)
+                for pair, count in old_counts.items():
+                    stats[pair] -= count * freq
+                    if pair not in new_counts and pair != best_pair:
+                        indices[pair].discard(j)
+                        if first[pair][0] == j:
+                            stale.add(pair)
+                for pair, count in new_counts.items():
+                    stats[pair] += count * freq
+                    indices[pair].add(j)
+                    if pair not in first or first[pair][0] == j or (j, new_offsets[pair]) < first[pair]:
+                        first[pair] = (j, new_offsets[pair])
+                changed.update(old_counts)
+                changed.update(new_counts)
+                words[j] = new_symbols
+            changed.discard(best_pair)
+            del stats[best_pair]
+            del first[best_pair]
+            for pair in stale:
+                if indices[pair]:
+                    j = min(indices[pair])
+                    first[pair] = (j, pair_offsets(words[j])[1][pair])
+            for pair in changed:
+                if stats[pair] > 0:
+                    heapq.heappush(heap, (-stats[pair], first[pair], pair))
+                else:
+                    del stats[pair], first[pair], indices[pair]
+        yield step, list(bpe_codes), {' '.join(symbols): freq for symbols, freq in zip(words, freqs)}
 
 def learn_bpe(word_freq, num_merges):
     """
@@ -62,34 +141,38 @@ def learn_bpe(word_freq, num_merges):
         list: List of BPE merge operations.
         dict: Final vocabulary after merges.
     """
-    vocab = initialize_vocabulary(word_freq)
-    bpe_codes = []
-    for i in range(num_merges):
-        pairs = get_stats(vocab)
-        if not pairs:
-            break
-        best_pair = max(pairs, key=pairs.get)
-        vocab = merge_vocab(best_pair, vocab)
-        bpe_codes.append(best_pair)
-    return bpe_codes, vocab
-
-def apply_bpe(word, bpe_codes):
+    for _, bpe_codes, vocab in learn_bpe_snapshots(word_freq, [num_merges]):
+        return bpe_codes, vocab
+
+@functools.lru_cache(maxsize=8)
+def compile_bpe_codes(bpe_codes):
+    """
+    Builds the applier of a list of merge operations, reused while the same codes are applied. The
+    merges are learned without an end-of-word marker, so none is added to the words.
+
+    Args:
+        bpe_codes (tuple): Tuple of BPE merge operations.
+
+    Returns:
+        BPEApplier: The applier of the codes.
+    """
+    return BPEApplier(bpe_codes, end_of_word='')
+
+def apply_bpe(words, bpe_codes):
     """
-    Applies Byte Pair Encoding (BPE) to a given word.
+    Applies Byte Pair Encoding (BPE) to a word or to a batch of words.
 
     Args:
-        word (str): The word to apply BPE to.
+        words (str or iterable): The word, or the words, to apply BPE to.
         bpe_codes (list): List of BPE merge operations.
 
     Returns:
-        list: List of BPE tokens.
+        list: List of BPE tokens of the word, or one such list per word of a batch.
     """
-    word = ' '.join(word)
-    for pair in bpe_codes:
-        bigram = ' '.join(pair)
-        replacement = ''.join(pair)
-        word = re.sub(bigram, replacement, word)
-    return word.split()
+    applier = compile_bpe_codes(tuple(map(tuple, bpe_codes)))
+    if isinstance(words, str):
+        return list(applier.encode(words))
+    return [list(applier.encode(word)) for word in words]
 
 def tokenize_corpus(text, bpe_codes):
     """
@@ -102,8 +185,8 @@ def tokenize_corpus(text, bpe_codes):
     Returns:
         set: Set of BPE tokens.
     """
-    words = text.split()
+    words = dict.fromkeys(text.split())
     tokens = set()
-    for word in words:
-        tokens.update(apply_bpe(word, bpe_codes))
+    for word_tokens in apply_bpe(words, bpe_codes):
+        tokens.update(word_tokens)
     return tokens
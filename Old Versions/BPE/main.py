@@ -91,7 +91,7 @@ def main():
     tokens = tokenize_corpus(normalized_text, bpe_codes)
     
     logging.info("Saving tokens with words")
-    save_tokens_with_words(tokens, word_freq.keys(), output_tokens_file)
+    save_tokens_with_words(bpe_codes, word_freq.keys(), output_tokens_file)
     
     original_vocab = initialize_vocabulary(word_freq)
     compression_ratio = calculate_compression_ratio(original_vocab, final_vocab)
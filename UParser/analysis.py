@@ -1,4 +1,4 @@
-from segmentation import compare_segments
+from evaluation import evaluate_segmentations
 
 def calculate_coverage(bpe_segments, segmented_words):
     """
@@ -11,8 +11,8 @@ def calculate_coverage(bpe_segments, segmented_words):
     Returns:
     float: The coverage percentage.
     """
-    correct_segmentations = compare_segments(bpe_segments, segmented_words)
-    return len(correct_segmentations) / len(bpe_segments) * 100
+    scores, _ = evaluate_segmentations(bpe_segments, segmented_words)
+    return scores["exact_match"]
 
 
 
@@ -0,0 +1,106 @@
+TRACE_MODES = ("off", "buffered", "sampled")
+
+
+class TraceSink:
+    """
+    Destination for the per-word analysis lines written by UChunker.analyse.
+    This base class discards everything and is used for the "off" mode.
+    """
+
+    def start_iteration(self, iteration, is_final):
+        """
+        Signals the start of a training iteration.
+        :param iteration: Index of the iteration that is starting.
+        :param is_final: Whether it is the last iteration of the run.
+        """
+
+    def record(self, segments):
+        """
+        Records the analysis of one word.
+        :param segments: Segments of the analysis, in the order they are written.
+        """
+
+    def flush(self):
+        """Writes any buffered lines to disk."""
+
+    def close(self):
+        """Releases the underlying file, if any."""
+
+
+class BufferedTraceSink(TraceSink):
+    """
+    Writes every analysis through one long-lived file handle with a large write buffer.
+    The file is opened on the first write and flushed once per iteration.
+    """
+
+    def __init__(self, path, buffer_size=1 << 20):
+        """
+        :param path: File the analyses are appended to.
+        :param buffer_size: Size in bytes of the write buffer.
+        """
+        self.path = path
+        self.buffer_size = buffer_size
+        self.file = None
+
+    def record(self, segments):
+        if self.file is None:
+            self.file = open(self.path, "a", encoding="UTF-8", buffering=self.buffer_size)
+        self.file.write(f"Análise: {' '.join(segments)}\n")
+
+    def flush(self):
+        if self.file is not None:
+            self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class SampledTraceSink(BufferedTraceSink):
+    """
+    Buffered sink that only records every Nth analysis and, optionally, only during the final iteration.
+    """
+
+    def __init__(self, path, every=100, final_only=False, buffer_size=1 << 20):
+        """
+        :param path: File the analyses are appended to.
+        :param every: Records one analysis out of every `every` analyses.
+        :param final_only: If True, only analyses made during the final iteration are recorded.
+        :param buffer_size: Size in bytes of the write buffer.
+        """
+        super().__init__(path, buffer_size)
+        if every < 1:
+            raise ValueError("The sampling interval must be at least 1.")
+        self.every = every
+        self.final_only = final_only
+        self.active = not final_only
+        self.seen = 0
+
+    def start_iteration(self, iteration, is_final):
+        self.active = is_final or not self.final_only
+
+    def record(self, segments):
+        if not self.active:
+            return
+        self.seen += 1
+        if self.seen % self.every == 0:
+            super().record(segments)
+
+
+def create_trace_sink(mode, path, every=100, final_only=False):
+    """
+    Creates the trace sink for the given mode.
+    :param mode: One of TRACE_MODES.
+    :param path: File the analyses are appended to (ignored when mode is "off").
+    :param every: Sampling interval for the "sampled" mode.
+    :param final_only: For the "sampled" mode, only record the final iteration.
+    :return: A TraceSink instance.
+    """
+    if mode == "off":
+        return TraceSink()
+    if mode == "buffered":
+        return BufferedTraceSink(path)
+    if mode == "sampled":
+        return SampledTraceSink(path, every=every, final_only=final_only)
+    raise ValueError(f"Unknown trace mode: {mode}. Choose one of {', '.join(TRACE_MODES)}.")
@@ -0,0 +1,213 @@
+import os
+import json
+import lzma
+import struct
+from collections import Counter
+from bpe_learner import write_bpe_codes
+from segmentation import save_correct_segmentations
+
+MAGIC = b"UPBPE001"
+# Record header: kind, number of merges (-1 for the language record) and payload length
+RECORD_HEADER = struct.Struct(">cqQ")
+LANGUAGE_RECORD = b"L"
+STEP_RECORD = b"S"
+
+
+class ArtifactWriter:
+    """
+    Writes the artefacts of a BPE merge sweep of one language to a single file. The merge list, the
+    corpus and the linguist's segmentations are stored once; each step only stores the lines of the
+    segmented corpus that changed since the previous step and the changes to the set of correctly
+    segmented lines. Every record is compressed with lzma, and its header holds the number of merges of
+    the step, so that a reader can index the steps without decompressing them. The store is written to
+    a temporary file that only replaces path when the writer is closed, so an interrupted sweep never
+    leaves a store with part of its steps.
+    """
+
+    def __init__(self, path, merges, corpus_lines, gold_lines):
+        """
+        :param path: File of the store; an existing store is replaced on close.
+        :param merges: Merge operations learned for the largest step; each step keeps a prefix of them.
+        :param corpus_lines: Lines of the preprocessed corpus, with their line endings.
+        :param gold_lines: Linguist's segmentation of each corpus line, with its line ending.
+        """
+        self.path = path
+        self.temp_path = f"{path}.tmp"
+        self.file = open(self.temp_path, "wb")
+        self.file.write(MAGIC)
+        self.write_record(LANGUAGE_RECORD, -1, {
+            "merges": [list(pair) for pair in merges], "corpus": corpus_lines, "gold": gold_lines,
+        })
+        self.lines = list(corpus_lines)
+        self.correct = set()
+
+    def write_record(self, kind, num_merges, value):
+        payload = lzma.compress(json.dumps(value).encode("UTF-8"))
+        self.file.write(RECORD_HEADER.pack(kind, num_merges, len(payload)))
+        self.file.write(payload)
+
+    def add_step(self, num_merges, segmented_lines, correct):
+        """
+        Stores one step of the sweep as a delta against the previous one.
+        :param num_merges: Number of merge operations of the step.
+        :param segmented_lines: Lines of the segmented corpus, as apply-bpe writes them (with "@@" markers).
+        :param correct: Boolean sequence telling which lines are segmented as the linguist did.
+        """
+        changed_lines = [
+            [index, line] for index, (line, previous) in enumerate(zip(segmented_lines, self.lines)) if line != previous
+        ]
+        correct = {index for index, is_correct in enumerate(correct) if is_correct}
+        self.write_record(STEP_RECORD, num_merges, {
+            "lines": changed_lines,
+            "correct_added": sorted(correct - self.correct),
+            "correct_removed": sorted(self.correct - correct),
+        })
+        self.lines = list(segmented_lines)
+        self.correct = correct
+
+    def close(self):
+        """
+        Finishes the store and moves it to its path.
+        """
+        self.file.close()
+        os.replace(self.temp_path, self.path)
+
+    def discard(self):
+        """
+        Abandons the store, leaving any previous store at its path untouched.
+        """
+        self.file.close()
+        os.remove(self.temp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+
+class ArtifactReader:
+    """
+    Reads a store written by ArtifactWriter and rebuilds the artefacts of any of its steps: the merge
+    operations, the segmented corpus, its subword frequencies and the correct segmentations.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: File of the store.
+        """
+        self.path = path
+        # Offset of each record's payload, found from the record headers alone
+        self.steps = {}
+        with open(path, "rb") as file:
+            if file.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a BPE artefact store")
+            header = file.read(RECORD_HEADER.size)
+            while header:
+                kind, num_merges, length = RECORD_HEADER.unpack(header)
+                if kind == LANGUAGE_RECORD:
+                    self.language_offset = (file.tell(), length)
+                else:
+                    self.steps[num_merges] = (file.tell(), length)
+                file.seek(length, os.SEEK_CUR)
+                header = file.read(RECORD_HEADER.size)
+        language = self.read_record(*self.language_offset)
+        self.merges = [tuple(pair) for pair in language["merges"]]
+        self.corpus_lines = language["corpus"]
+        self.gold_lines = language["gold"]
+        # Last step rebuilt, so that reading the steps in order applies each delta once
+        self.state = (None, list(self.corpus_lines), set())
+
+    def read_record(self, offset, length):
+        with open(self.path, "rb") as file:
+            file.seek(offset)
+            return json.loads(lzma.decompress(file.read(length)).decode("UTF-8"))
+
+    def step_numbers(self):
+        """
+        :return: Numbers of merges of the stored steps, in increasing order.
+        """
+        return sorted(self.steps)
+
+    def rebuild(self, num_merges):
+        """
+        Applies the deltas of the steps up to num_merges.
+        :param num_merges: Number of merges of a stored step.
+        :return: Tuple (segmented lines, set of correctly segmented line indices).
+        """
+        if num_merges not in self.steps:
+            raise KeyError(f"No step with {num_merges} merges in {self.path}")
+        current, lines, correct = self.state
+        if current is None or current > num_merges:
+            current, lines, correct = None, list(self.corpus_lines), set()
+        for step in self.step_numbers():
+            if (current is not None and step <= current) or step > num_merges:
+                continue
+            delta = self.read_record(*self.steps[step])
+            for index, line in delta["lines"]:
+                lines[index] = line
+            correct.difference_update(delta["correct_removed"])
+            correct.update(delta["correct_added"])
+        self.state = (num_merges, lines, correct)
+        return list(lines), set(correct)
+
+    def codes(self, num_merges):
+        """
+        :return: Merge operations of the step, as learn_bpe returns them.
+        """
+        return self.merges[:num_merges]
+
+    def segmented_lines(self, num_merges):
+        """
+        :return: Lines of the segmented corpus of the step, as apply-bpe writes them (with "@@" markers).
+        """
+        return self.rebuild(num_merges)[0]
+
+    def segmented_corpus(self, num_merges):
+        """
+        :return: Lines of the segmented corpus of the step, with the "@@" markers removed.
+        """
+        return [line.replace('@@ ', ' ') for line in self.segmented_lines(num_merges)]
+
+    def frequencies(self, num_merges):
+        """
+        :return: Counter of the subwords of the step, in order of first occurrence.
+        """
+        return Counter("".join(self.segmented_lines(num_merges)).split())
+
+    def correct_segmentations(self, num_merges):
+        """
+        :return: List of (BPE segmentation, linguist's segmentation) of the correctly segmented lines.
+        """
+        lines, correct = self.rebuild(num_merges)
+        return [
+            (lines[index].replace('@@ ', ' ').strip(), self.gold_lines[index].strip()) for index in sorted(correct)
+        ]
+
+    def export(self, num_merges, base_path, language):
+        """
+        Writes the files of a step to the directories bpe_operations, segmented_corpus (with its
+        .freqs.txt) and correct_segmentations of the language.
+        :param num_merges: Number of merges of a stored step.
+        :param base_path: Directory of the language.
+        :param language: Name of the language, used in the file names.
+        :return: Path of the correct segmentations file.
+        """
+        for directory in ("bpe_operations", "segmented_corpus", "correct_segmentations"):
+            os.makedirs(os.path.join(base_path, directory), exist_ok=True)
+        write_bpe_codes(os.path.join(base_path, "bpe_operations", f"bpe_operations_{num_merges}_{language}.txt"),
+                        self.codes(num_merges))
+
+        segmented_corpus_path = os.path.join(base_path, "segmented_corpus", f"segmented_corpus_{num_merges}_{language}.txt")
+        with open(segmented_corpus_path, "w", encoding="UTF-8") as file:
+            file.writelines(self.segmented_corpus(num_merges))
+        with open(f"{segmented_corpus_path}.freqs.txt", "w", encoding="UTF-8") as file:
+            for word, count in self.frequencies(num_merges).items():
+                file.write(f"{word} {count}\n")
+
+        correct_segmentations_path = os.path.join(base_path, "correct_segmentations", f"correct_segmentations_{num_merges}_{language}.txt")
+        save_correct_segmentations(self.correct_segmentations(num_merges), correct_segmentations_path)
+        return correct_segmentations_path
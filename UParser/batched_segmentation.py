@@ -0,0 +1,135 @@
+from math import inf
+import numpy as np
+
+# Upper bound on the number of span costs materialised at once (batch x positions x segment lengths)
+MAX_SPAN_CELLS = 1 << 22
+
+
+class TrieTable:
+    """
+    Dense form of a LexiconTrie: node transitions as a (nodes x alphabet) array, so that the trie can be
+    walked for a whole batch of spans with a single NumPy gather per character.
+    Node 0 is the root and the last node is a dead state that every missing transition leads to.
+    """
+
+    def __init__(self, trie, n_codes, segment_costs):
+        """
+        :param trie: LexiconTrie over character codes, holding segment ids.
+        :param n_codes: Size of the alphabet.
+        :param segment_costs: Array mapping each segment id to its cost.
+        """
+        nodes = [trie.root]
+        depth = 0
+        frontier = [trie.root]
+        while frontier:
+            depth += 1
+            next_frontier = []
+            for node in frontier:
+                for code, child in node.items():
+                    if code is not trie.END:
+                        next_frontier.append(child)
+            nodes.extend(next_frontier)
+            frontier = next_frontier
+        node_ids = {id(node): node_id for node_id, node in enumerate(nodes)}
+        dead = len(nodes)
+
+        self.transitions = np.full((len(nodes) + 1, n_codes), dead, dtype=np.int32)
+        self.segment_ids = np.full(len(nodes) + 1, -1, dtype=np.int64)
+        self.costs = np.full(len(nodes) + 1, inf)
+        for node_id, node in enumerate(nodes):
+            for code, child in node.items():
+                if code is trie.END:
+                    self.segment_ids[node_id] = child
+                    self.costs[node_id] = segment_costs[child]
+                else:
+                    self.transitions[node_id, code] = node_ids[id(child)]
+        self.max_length = depth - 1
+
+
+def segment_batch(table, segment_costs, codes):
+    """
+    Min-cost segmentation of a batch of same-length words, as array operations over (batch x position)
+    cost matrices. It follows segment_sequence step by step: candidates for each final position are
+    ordered by start position and the first minimum is kept, so ties and the single-character fallback
+    resolve exactly as in the scalar engine.
+
+    :param table: TrieTable of the current lexicon.
+    :param segment_costs: Array mapping each segment id to its cost.
+    :param codes: Integer array (batch x length) of character codes.
+    :return: List of (cost, segment ids) analyses, one per row.
+    """
+    batch, length = codes.shape
+    max_length = min(table.max_length, length)
+    rows = np.arange(batch)
+
+    # span_costs[:, i, l - 1] / span_ids[:, i, l - 1]: cost and id of the lexicon entry codes[:, i:i + l]
+    span_costs = np.full((batch, length, max_length), inf)
+    span_ids = np.full((batch, length, max_length), -1, dtype=np.int64)
+    nodes = np.zeros((batch, length), dtype=np.int32)
+    for span_length in range(1, max_length + 1):
+        starts = length - span_length + 1
+        nodes = table.transitions[nodes[:, :starts], codes[:, span_length - 1:]]
+        span_costs[:, :starts, span_length - 1] = table.costs[nodes]
+        span_ids[:, :starts, span_length - 1] = table.segment_ids[nodes]
+
+    costs = np.full((batch, length + 1), inf)
+    costs[:, 0] = 0
+    last_segment = np.empty((batch, length + 1), dtype=np.int64)
+    last_segment_length = np.ones((batch, length + 1), dtype=np.int64)
+    for final_position in range(1, length + 1):
+        # Candidates from the earliest start (longest span) to the latest one
+        span_lengths = np.arange(min(final_position, max_length), 0, -1)
+        starts = final_position - span_lengths
+        candidates = span_costs[:, starts, span_lengths - 1] + costs[:, starts]
+        best = np.argmin(candidates, axis=1)
+        best_costs = candidates[rows, best]
+        reachable = best_costs != inf
+        costs[:, final_position] = best_costs
+        last_segment[:, final_position] = np.where(
+            reachable, span_ids[rows, starts[best], span_lengths[best] - 1], codes[:, final_position - 1]
+        )
+        last_segment_length[:, final_position] = np.where(reachable, span_lengths[best], 1)
+
+    analyses = []
+    last_segment = last_segment.tolist()
+    last_segment_length = last_segment_length.tolist()
+    for row in range(batch):
+        final_segments = []
+        final_position = length
+        while final_position > 0:
+            final_segments.append(last_segment[row][final_position])
+            final_position -= last_segment_length[row][final_position]
+        # Python summation in the scalar engine's order, so the costs are bit-for-bit identical
+        cost_of_analysis = sum(segment_costs[segment_id] for segment_id in final_segments)
+        analyses.append((cost_of_analysis, final_segments[::-1]))
+    return analyses
+
+
+def segment_words(trie, segment_costs, n_codes, code_sequences):
+    """
+    Segments words with the batched kernel, grouping them by length.
+    :param trie: LexiconTrie over character codes, holding segment ids.
+    :param segment_costs: Array mapping each segment id to its cost.
+    :param n_codes: Size of the alphabet.
+    :param code_sequences: List of words as sequences of character codes.
+    :return: List of (cost, segment ids) analyses, in the order of code_sequences.
+    """
+    table = TrieTable(trie, n_codes, segment_costs)
+    by_length = {}
+    for index, code_sequence in enumerate(code_sequences):
+        by_length.setdefault(len(code_sequence), []).append(index)
+
+    analyses = [None] * len(code_sequences)
+    for length, indices in by_length.items():
+        if length == 0:
+            for index in indices:
+                analyses[index] = (0, [])
+            continue
+        cells_per_word = length * max(1, min(table.max_length, length))
+        batch_size = max(1, MAX_SPAN_CELLS // cells_per_word)
+        for batch_start in range(0, len(indices), batch_size):
+            batch = indices[batch_start:batch_start + batch_size]
+            codes = np.array([list(code_sequences[index]) for index in batch], dtype=np.int64)
+            for index, analysis in zip(batch, segment_batch(table, segment_costs, codes)):
+                analyses[index] = analysis
+    return analyses
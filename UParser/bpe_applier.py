@@ -0,0 +1,117 @@
+from collections import OrderedDict
+from bpe_learner import END_OF_WORD
+
+
+def merge_ranks(merges):
+    """
+    Rank of each merge operation, as subword-nmt apply-bpe reads a codes file: a pair learned twice keeps
+    the rank of its first occurrence.
+
+    Parameters:
+    merges (list): Merge operations returned by learn_bpe.
+
+    Returns:
+    dict: Mapping from each (first, second) pair to its rank.
+    """
+    ranks = {}
+    for rank, pair in enumerate(merges):
+        ranks.setdefault(pair, rank)
+    return ranks
+
+
+def merge_symbols(symbols, ranks):
+    """
+    Merge the symbols of a word as apply-bpe does: the pair of lowest rank is merged (every occurrence,
+    left to right) until no pair of the word has a rank. This is the only implementation of the merge
+    loop; encode_word, the sweep's boundary_ranks and the legacy BPE project all build on it.
+
+    Parameters:
+    symbols (list): Initial symbols of the word.
+    ranks (dict): Merge ranks (see merge_ranks).
+
+    Yields:
+    tuple: (rank, positions, symbols) after each merge: the rank of the merged pair, the positions in the
+    previous symbols where it was merged, and the new symbols.
+    """
+    while len(symbols) > 1:
+        pairs = [(ranks[pair], i, pair) for i, pair in enumerate(zip(symbols, symbols[1:])) if pair in ranks]
+        if not pairs:
+            break
+        rank, _, bigram = min(pairs)
+        merged = ''.join(bigram)
+        new_symbols = []
+        positions = []
+        i = 0
+        for j in [i for _, i, pair in pairs if pair == bigram]:
+            # Overlapping occurrences (x x x -> xx x) are skipped
+            if j < i:
+                continue
+            new_symbols.extend(symbols[i:j])
+            new_symbols.append(merged)
+            positions.append(j)
+            i = j + 2
+        new_symbols.extend(symbols[i:])
+        symbols = new_symbols
+        yield rank, positions, symbols
+
+
+def encode_word(word, ranks, end_of_word=END_OF_WORD):
+    """
+    Split a word into subwords, as apply-bpe does (see merge_symbols).
+
+    Parameters:
+    word (str): Word to encode.
+    ranks (dict): Merge ranks (see merge_ranks).
+    end_of_word (str): Marker the merges were learned with at the end of each word ('' for none). It
+    is appended to the last character before merging and removed from the subwords.
+
+    Returns:
+    tuple: The subwords of the word.
+    """
+    if len(word) <= 1:
+        return (word,)
+    symbols = list(word[:-1]) + [word[-1] + end_of_word]
+    for _, _, symbols in merge_symbols(symbols, ranks):
+        pass
+    if not end_of_word:
+        return tuple(symbols)
+    if symbols[-1] == end_of_word:
+        symbols = symbols[:-1]
+    elif symbols[-1].endswith(end_of_word):
+        symbols[-1] = symbols[-1][:-len(end_of_word)]
+    return tuple(symbols)
+
+
+class BPEApplier:
+    """
+    Applies BPE merge operations in a single process. The merges are compiled once into a pair -> rank
+    table, and each distinct word is encoded once: results are kept in a bounded least-recently-used
+    cache, so corpora with many repeated tokens only pay for their word types.
+    """
+
+    def __init__(self, merges, cache_size=1 << 16, end_of_word=END_OF_WORD):
+        """
+        :param merges: Merge operations, as returned by learn_bpe.
+        :param cache_size: Maximum number of words whose segmentation is kept.
+        :param end_of_word: End-of-word marker the merges were learned with ('' for none).
+        """
+        self.ranks = merge_ranks(merges)
+        self.end_of_word = end_of_word
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+
+    def encode(self, word):
+        """
+        Subwords of a word.
+        :param word: Word to encode.
+        :return: Tuple of subwords.
+        """
+        subwords = self.cache.get(word)
+        if subwords is not None:
+            self.cache.move_to_end(word)
+            return subwords
+        subwords = encode_word(word, self.ranks, self.end_of_word)
+        self.cache[word] = subwords
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return subwords
@@ -0,0 +1,137 @@
+import heapq
+from collections import Counter
+
+END_OF_WORD = '</w>'
+CODES_HEADER = '#version: 0.2\n'
+
+
+class DescendingPair:
+    """
+    Heap key ordering pairs from the largest to the smallest, so that among pairs of equal frequency the
+    min-heap pops the largest one first, as subword-nmt's max over (frequency, pair) does.
+    """
+    __slots__ = ("pair",)
+
+    def __init__(self, pair):
+        self.pair = pair
+
+    def __lt__(self, other):
+        return self.pair > other.pair
+
+
+def count_words(lines):
+    """
+    Count the words of corpus lines the way subword-nmt learn-bpe reads its input.
+
+    Parameters:
+    lines (iterable): Lines of the corpus.
+
+    Returns:
+    Counter: Frequency of each word.
+    """
+    vocab = Counter()
+    for line in lines:
+        for word in line.strip('\r\n ').split(' '):
+            if word:
+                vocab[word] += 1
+    return vocab
+
+
+def read_vocabulary(corpus_path):
+    """
+    Count the words of a corpus file the way subword-nmt learn-bpe reads its input.
+
+    Parameters:
+    corpus_path (str): The path to the corpus file.
+
+    Returns:
+    Counter: Frequency of each word.
+    """
+    with open(corpus_path, 'r', encoding='UTF-8') as file:
+        return count_words(file)
+
+
+def learn_bpe(vocab, num_merges, min_frequency=2):
+    """
+    Learn BPE merge operations, as subword-nmt learn-bpe does, in a single process.
+    Pair frequencies are kept exact: a merge only recounts the pairs of the words that contain the merged
+    pair (found through a pair -> words index), and the most frequent pair is taken from a lazy priority
+    queue. Because each merge only depends on the previous ones, the first n merges of a run are the
+    merges a run limited to n would learn.
+
+    Parameters:
+    vocab (Counter): Frequency of each word (see read_vocabulary).
+    num_merges (int): Maximum number of merge operations.
+    min_frequency (int): Stop when no pair occurs at least this many times.
+
+    Returns:
+    list: The merge operations, as (first, second) symbol pairs, in the order they were learned.
+    """
+    # Most frequent words first, as subword-nmt orders them
+    words = [list(word[:-1]) + [word[-1] + END_OF_WORD] for word, _ in sorted(vocab.items(), key=lambda x: x[1], reverse=True)]
+    freqs = [freq for _, freq in sorted(vocab.items(), key=lambda x: x[1], reverse=True)]
+
+    stats = Counter()
+    indices = {}
+    for j, (word, freq) in enumerate(zip(words, freqs)):
+        for pair in zip(word, word[1:]):
+            stats[pair] += freq
+            indices.setdefault(pair, set()).add(j)
+    heap = [(-count, DescendingPair(pair)) for pair, count in stats.items()]
+    heapq.heapify(heap)
+
+    merges = []
+    while len(merges) < num_merges:
+        # Entries are pushed on every change and checked against stats when popped
+        while heap and -heap[0][0] != stats.get(heap[0][1].pair, 0):
+            heapq.heappop(heap)
+        if not heap or -heap[0][0] < min_frequency:
+            break
+        first, second = most_frequent = heapq.heappop(heap)[1].pair
+        merges.append(most_frequent)
+        merged = first + second
+
+        changed = set()
+        for j in indices.pop(most_frequent):
+            word, freq = words[j], freqs[j]
+            new_word = []
+            i = 0
+            while i < len(word):
+                if i < len(word) - 1 and word[i] == first and word[i + 1] == second:
+                    new_word.append(merged)
+                    i += 2
+                else:
+                    new_word.append(word[i])
+                    i += 1
+            old_pairs = Counter(zip(word, word[1:]))
+            new_pairs = Counter(zip(new_word, new_word[1:]))
+            for pair, count in old_pairs.items():
+                stats[pair] -= count * freq
+                if pair not in new_pairs and pair != most_frequent:
+                    indices[pair].discard(j)
+            for pair, count in new_pairs.items():
+                stats[pair] += count * freq
+                indices.setdefault(pair, set()).add(j)
+            changed.update(old_pairs)
+            changed.update(new_pairs)
+            words[j] = new_word
+        del stats[most_frequent]
+        changed.discard(most_frequent)
+        for pair in changed:
+            if stats[pair] > 0:
+                heapq.heappush(heap, (-stats[pair], DescendingPair(pair)))
+    return merges
+
+
+def write_bpe_codes(codes_path, merges):
+    """
+    Write merge operations as a subword-nmt codes file.
+
+    Parameters:
+    codes_path (str): The path of the codes file.
+    merges (list): Merge operations returned by learn_bpe.
+    """
+    with open(codes_path, 'w', encoding='UTF-8') as file:
+        file.write(CODES_HEADER)
+        for first, second in merges:
+            file.write(f'{first} {second}\n')
@@ -0,0 +1,111 @@
+from math import inf
+from collections import Counter
+from bpe_learner import END_OF_WORD
+from bpe_applier import merge_ranks, merge_symbols
+
+# Version of the BPE learner and sweep, part of the result cache key: bump it whenever a change
+# alters the segmentations learn_bpe and MergeSweep produce (not for changes that only make them faster)
+ENGINE_VERSION = 1
+
+
+def boundary_ranks(word, ranks):
+    """
+    Encode a word with every merge, as apply-bpe does (repeatedly merging the pair of lowest rank), and
+    record when each boundary between characters disappears. With the codes limited to the first n merges,
+    apply-bpe performs the same merges for as long as every rank used so far is below n, so a boundary is
+    still there after n merges exactly when the highest rank used up to its removal is n or more.
+
+    Parameters:
+    word (str): Word to encode.
+    ranks (dict): Merge ranks (see merge_ranks).
+
+    Returns:
+    list: For each character position (0 is unused), the highest rank used up to the removal of the
+    boundary before that character, or inf if it is never removed.
+    """
+    vanished = [inf] * len(word)
+    if len(word) <= 1:
+        return vanished
+    symbols = list(word[:-1]) + [word[-1] + END_OF_WORD]
+    # Position in the word of the first character of each symbol
+    starts = list(range(len(word)))
+    highest = -1
+    for rank, positions, _ in merge_symbols(symbols, ranks):
+        highest = max(highest, rank)
+        for j in reversed(positions):
+            vanished[starts[j + 1]] = highest
+            del starts[j + 1]
+    return vanished
+
+
+class MergeSweep:
+    """
+    Segmentations of a corpus for every prefix of one learned merge list. BPE merges are learned greedily,
+    so the codes for n merges are the first n merges of a longer run; the corpus word types are encoded a
+    single time with the whole list, recording the rank at which each boundary disappears, and the output
+    of apply-bpe for any number of merges is then read off those ranks.
+    """
+
+    def __init__(self, merges, lines, separator='@@'):
+        """
+        :param merges: Merge operations returned by learn_bpe, for the largest number of merges needed.
+        :param lines: Lines of the corpus, with their line endings, as apply-bpe reads them.
+        :param separator: Marker apply-bpe appends to non-final subwords.
+        """
+        self.separator = separator
+        self.lines = lines
+        ranks = merge_ranks(merges)
+        # Each line as (leading whitespace, tokens, trailing whitespace), as apply-bpe splits it
+        self.parsed_lines = []
+        self.token_counts = Counter()
+        self.boundaries = {}
+        for line in lines:
+            leading = len(line) - len(line.lstrip('\r\n '))
+            trailing = len(line) - len(line.rstrip('\r\n '))
+            tokens = [token for token in line.strip('\r\n ').split(' ') if token]
+            self.parsed_lines.append((
+                line[:leading], tokens, line[-trailing:] if trailing and trailing != len(line) else ''
+            ))
+            for token in tokens:
+                self.token_counts[token] += 1
+                if token not in self.boundaries:
+                    self.boundaries[token] = boundary_ranks(token, ranks)
+
+    def segment(self, token, num_merges):
+        """
+        Segmentation of a token with the first num_merges merges.
+        :param token: Token of the corpus.
+        :param num_merges: Number of merge operations.
+        :return: The token as apply-bpe writes it, with the separator after every non-final subword.
+        """
+        vanished = self.boundaries[token]
+        marker = self.separator + ' '
+        pieces = [token[0]]
+        for position in range(1, len(token)):
+            if vanished[position] >= num_merges:
+                pieces.append(marker)
+            pieces.append(token[position])
+        return ''.join(pieces)
+
+    def snapshot(self, num_merges):
+        """
+        Segmented corpus and subword frequencies after num_merges merges.
+        :param num_merges: Number of merge operations; with 0 the corpus is left unsegmented, as apply_bpe does.
+        :return: Tuple (segmented lines, frequencies): the lines apply-bpe would write, and the Counter of
+            their whitespace-separated subwords that calculate_frequencies would compute from them.
+        """
+        if num_merges == 0:
+            segmentations = {token: token for token in self.token_counts}
+            segmented_lines = list(self.lines)
+        else:
+            segmentations = {token: self.segment(token, num_merges) for token in self.token_counts}
+            segmented_lines = [
+                leading + ' '.join(segmentations[token] for token in tokens) + trailing
+                for leading, tokens, trailing in self.parsed_lines
+            ]
+        # Tokens come in order of first occurrence, so the counter keeps the order of the segmented file
+        freqs = Counter()
+        for token, count in self.token_counts.items():
+            for subword in segmentations[token].split():
+                freqs[subword] += count
+        return segmented_lines, freqs
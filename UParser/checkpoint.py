@@ -0,0 +1,91 @@
+import os
+import re
+import gzip
+import pickle
+import tempfile
+
+CHECKPOINT_VERSION = 1
+CHECKPOINT_PATTERN = re.compile(r"checkpoint_(\d+)\.ckpt$")
+
+
+def checkpoint_path(checkpoint_dir, iteration):
+    """
+    Path of the checkpoint saved after a given number of iterations.
+
+    Parameters:
+    checkpoint_dir (str): Directory holding the checkpoints.
+    iteration (int): Number of completed iterations.
+
+    Returns:
+    str: The checkpoint path.
+    """
+    return os.path.join(checkpoint_dir, f"checkpoint_{iteration:04d}.ckpt")
+
+
+def latest_checkpoint(checkpoint_dir, min_iteration=0, max_iteration=None):
+    """
+    Find the checkpoint with the most completed iterations within a range.
+
+    Parameters:
+    checkpoint_dir (str): Directory holding the checkpoints.
+    min_iteration (int): Fewest completed iterations of the checkpoints considered.
+    max_iteration (int): Most completed iterations of the checkpoints considered; None for no bound.
+
+    Returns:
+    str: Path of the latest checkpoint in the range, or None if there is none.
+    """
+    if not os.path.isdir(checkpoint_dir):
+        return None
+    latest, latest_iteration = None, -1
+    for filename in os.listdir(checkpoint_dir):
+        match = CHECKPOINT_PATTERN.match(filename)
+        if not match:
+            continue
+        iteration = int(match.group(1))
+        if iteration < min_iteration or (max_iteration is not None and iteration > max_iteration):
+            continue
+        if iteration > latest_iteration:
+            latest, latest_iteration = os.path.join(checkpoint_dir, filename), iteration
+    return latest
+
+
+def write_checkpoint(path, state):
+    """
+    Save a training state as a gzip-compressed pickle. The file is written to a temporary
+    file in the same directory and renamed over path, so a crash never leaves a partial checkpoint.
+
+    Parameters:
+    path (str): Destination path.
+    state (dict): Training state to save.
+    """
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    file_descriptor, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(file_descriptor, "wb") as raw_file:
+            with gzip.GzipFile(fileobj=raw_file, mode="wb") as file:
+                pickle.dump({"version": CHECKPOINT_VERSION, **state}, file, protocol=pickle.HIGHEST_PROTOCOL)
+            raw_file.flush()
+            os.fsync(raw_file.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def read_checkpoint(path):
+    """
+    Load a training state saved by write_checkpoint.
+
+    Parameters:
+    path (str): Checkpoint path.
+
+    Returns:
+    dict: The saved training state.
+    """
+    with gzip.open(path, "rb") as file:
+        state = pickle.load(file)
+    if state.get("version") != CHECKPOINT_VERSION:
+        raise ValueError(f"Unsupported checkpoint version in {path}: {state.get('version')}")
+    return state
@@ -1,27 +1,118 @@
-def compare_morphemes_to_file(lexicon, morphemes_filename, output_filename):
+from bisect import bisect_left
+
+
+class LexiconIndex:
+    """
+    Inverted index from each morpheme to the positions of the lexicon segments containing it, built once
+    per lexicon, so that target lines are compared with hash lookups instead of a scan of the whole lexicon.
+    Results are memoised per line, so one index serves every line (and every file) compared to the lexicon.
+    """
+
+    def __init__(self, lexicon):
+        """
+        :param lexicon: Lexicon to compare against; only its keys, in order, are used.
+        """
+        self.keys = list(lexicon.keys())
+        self.segments = [segment.split() for segment in self.keys]
+        self.positions = {}
+        for position, segment_morphemes in enumerate(self.segments):
+            for morpheme in segment_morphemes:
+                positions = self.positions.setdefault(morpheme, [])
+                if not positions or positions[-1] != position:
+                    positions.append(position)
+        self.matches = {}
+        self.overlaps = {}
+
+    def best_overlap(self, morphemes):
+        """
+        Segment sharing the most distinct morphemes with a target line, found by counting the postings of
+        the line's morphemes, so only segments sharing a morpheme with it are touched. Ties go to the segment
+        that comes first in the lexicon.
+        :param morphemes: Iterable of the morphemes of the line.
+        :return: Tuple (segment, number of morphemes in common), or (None, 0) if no segment shares any.
+        """
+        morpheme_set = frozenset(morphemes)
+        overlap = self.overlaps.get(morpheme_set)
+        if overlap is not None:
+            return overlap
+
+        counts = {}
+        for morpheme in morpheme_set:
+            for position in self.positions.get(morpheme, ()):
+                counts[position] = counts.get(position, 0) + 1
+        best_position, best_match_size = None, 0
+        for position, count in counts.items():
+            if count > best_match_size or (count == best_match_size and position < best_position):
+                best_position, best_match_size = position, count
+        overlap = (self.keys[best_position], best_match_size) if best_position is not None else (None, 0)
+        self.overlaps[morpheme_set] = overlap
+        return overlap
+
+    def matched_segments(self, target_morphemes):
+        """
+        Morphemes of a target line matched by the lexicon, exactly as the scan of compare_segmentations_to_file
+        finds them: for each segment in lexicon order, the longest prefix of the remaining morphemes that is a
+        subsequence of the segment is matched, then every matched morpheme is removed once from the remaining
+        ones. While no matched morpheme remains, a segment only changes anything if it contains the first
+        remaining morpheme, so the scan jumps straight to the next such segment.
+        :param target_morphemes: List of the morphemes of the line.
+        :return: List of the matched morphemes, in the order they were matched.
+        """
+        key = tuple(target_morphemes)
+        matched_segments = self.matches.get(key)
+        if matched_segments is not None:
+            return matched_segments
+
+        matched_segments = []
+        matched_set = set()
+        remaining_morphemes = list(target_morphemes)
+        position = 0
+        while position < len(self.segments) and remaining_morphemes:
+            if matched_set.isdisjoint(remaining_morphemes):
+                positions = self.positions.get(remaining_morphemes[0])
+                if positions is None:
+                    break
+                k = bisect_left(positions, position)
+                if k == len(positions):
+                    break
+                position = positions[k]
+
+            segment_morphemes = self.segments[position]
+            i = 0
+            j = 0
+            while i < len(remaining_morphemes) and j < len(segment_morphemes):
+                if remaining_morphemes[i] == segment_morphemes[j]:
+                    matched_segments.append(remaining_morphemes[i])
+                    i += 1
+                j += 1
+            matched_set.update(matched_segments[len(matched_segments) - i:])
+            for morpheme in matched_segments:
+                if morpheme in remaining_morphemes:
+                    remaining_morphemes.remove(morpheme)
+            position += 1
+
+        self.matches[key] = matched_segments
+        return matched_segments
+
+
+def compare_morphemes_to_file(lexicon, morphemes_filename, output_filename, index=None):
     """
     Compares morphemes and writes the best matches to a file.
     :param lexicon: Lexicon to compare against.
     :param morphemes_filename: File containing morphemes.
     :param output_filename: File to write the comparison results.
+    :param index: LexiconIndex of the lexicon, to reuse one across calls; built if not given.
     :return: Number of best matches found and total morphemes.
     """
+    if index is None:
+        index = LexiconIndex(lexicon)
     best_matches_found = 0
     total_morphemes = 0
 
     with open(morphemes_filename, "r", encoding="utf-8") as morphemes_file, open(output_filename, "w", encoding="utf-8") as output_file:
         for morpheme in morphemes_file:
             morpheme = morpheme.strip()
-            morpheme_set = set(morpheme.split())  # converte os morfemas em um set
-            best_match = None
-            best_match_size = 0
-            for segment in lexicon.keys():
-                segment_set = set(segment.split())  # converte segmentos em um set
-                intersection = morpheme_set & segment_set  # Interseção
-                union = morpheme_set | segment_set  # União
-                if len(intersection) > best_match_size:
-                    best_match = segment
-                    best_match_size = len(intersection)
+            best_match, best_match_size = index.best_overlap(morpheme.split())
             if best_match is not None:
                 output_file.write(f"Linha alvo: '{morpheme}' - Melhor correspondência: '{best_match}' (com {best_match_size} palavras em comum)\n")
                 best_matches_found += 1
@@ -31,14 +122,18 @@ def compare_morphemes_to_file(lexicon, morphemes_filename, output_filename):
 
     return best_matches_found, total_morphemes
 
-def compare_segmentations_to_file(lexicon, morphemes_filename, output_filename):
+
+def compare_segmentations_to_file(lexicon, morphemes_filename, output_filename, index=None):
     """
     Compares segmentations and writes the best matches to a file.
     :param lexicon: Lexicon to compare against.
     :param morphemes_filename: File containing morphemes.
     :param output_filename: File to write the comparison results.
+    :param index: LexiconIndex of the lexicon, to reuse one across calls; built if not given.
     :return: Number of best matches found and total morphemes.
     """
+    if index is None:
+        index = LexiconIndex(lexicon)
     best_matches_found = 0
     total_morphemes = 0
 
@@ -46,25 +141,7 @@ def compare_segmentations_to_file(lexicon, morphemes_filename, output_filename):
         for morpheme_line in morphemes_file:
             morpheme_line = morpheme_line.strip()
             target_morphemes = morpheme_line.split()  # Lista de morfemas alvo
-            matched_segments = []
-            remaining_morphemes = target_morphemes.copy()
-
-            for segment in lexicon.keys():
-                segment_morphemes = segment.split()  # Lista de morfemas do segmento
-                i = 0
-                j = 0
-                while i < len(remaining_morphemes) and j < len(segment_morphemes):
-                    if remaining_morphemes[i] == segment_morphemes[j]:
-                        matched_segments.append(remaining_morphemes[i])
-                        i += 1
-                        j += 1
-                    else:
-                        j += 1  # Avança para o próximo morfema do segmento
-
-                # Remove os morfemas correspondentes da lista remaining_morphemes
-                for morpheme in matched_segments:
-                    if morpheme in remaining_morphemes:
-                        remaining_morphemes.remove(morpheme)
+            matched_segments = index.matched_segments(target_morphemes)
 
             # Verifica se todos os morfemas da linha alvo foram encontrados na ordem correta
             if len(target_morphemes) == len(matched_segments) and target_morphemes == matched_segments:
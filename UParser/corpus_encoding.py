@@ -0,0 +1,172 @@
+import hashlib
+from array import array
+
+
+class Alphabet:
+    """
+    Table mapping each character of a corpus to a small integer code.
+    Codes are assigned in order of first occurrence and stored with the narrowest array typecode that fits.
+    """
+
+    def __init__(self, chars):
+        """
+        :param chars: Iterable of characters; repeated characters are ignored.
+        """
+        self.codes = {}
+        self.chars = []
+        for char in chars:
+            if char not in self.codes:
+                self.codes[char] = len(self.chars)
+                self.chars.append(char)
+        if len(self.chars) <= 1 << 8:
+            self.typecode = 'B'
+        elif len(self.chars) <= 1 << 16:
+            self.typecode = 'H'
+        else:
+            self.typecode = 'I'
+        self.width = array(self.typecode).itemsize
+
+    def __len__(self):
+        return len(self.chars)
+
+    def encode(self, word):
+        """
+        Encodes a word.
+        :param word: Word made of characters of the alphabet.
+        :return: Bytes holding one code of self.width bytes per character.
+        """
+        try:
+            return array(self.typecode, [self.codes[char] for char in word]).tobytes()
+        except KeyError as e:
+            raise ValueError(f"Character {e.args[0]!r} is not in the corpus alphabet.") from None
+
+    def decode(self, key):
+        """
+        Materialises an encoded word or segment as a string.
+        :param key: Bytes returned by encode (or a slice of it aligned on self.width).
+        :return: The decoded string.
+        """
+        chars = self.chars
+        return ''.join([chars[code] for code in array(self.typecode, key)])
+
+    def code_sequence(self, key):
+        """
+        Views an encoded word as a sequence of integer codes, without copying it.
+        :param key: Encoded word.
+        :return: Memoryview indexable by character position.
+        """
+        return memoryview(key).cast(self.typecode)
+
+
+class EncodedCorpus:
+    """
+    Compact representation of a corpus. Distinct words are encoded once and stored in one contiguous
+    buffer with an offsets array; the running text is an array of word type ids.
+    The arrays are exposed as read-only memoryviews, so one corpus can be shared by several chunkers.
+    """
+
+    def __init__(self, words):
+        """
+        :param words: List of the corpus tokens, in order.
+        """
+        self.alphabet = Alphabet(char for word in words for char in word)
+        width = self.alphabet.width
+        type_ids = {}
+        buffer = bytearray()
+        offsets = array('I', [0])
+        frequencies = array('I')
+        tokens = array('I')
+        for word in words:
+            type_id = type_ids.get(word)
+            if type_id is None:
+                type_id = type_ids[word] = len(frequencies)
+                buffer += self.alphabet.encode(word)
+                offsets.append(len(buffer) // width)
+                frequencies.append(0)
+            frequencies[type_id] += 1
+            tokens.append(type_id)
+        self.buffer = bytes(buffer)
+        self.offsets = memoryview(offsets).toreadonly()
+
+        # Occurrences of each character code in the running text
+        char_counts = array('q', bytes(8 * len(self.alphabet)))
+        for type_id, freq in enumerate(frequencies):
+            for code in self.word_codes(type_id):
+                char_counts[code] += freq
+        self.frequencies = memoryview(frequencies).toreadonly()
+        self.tokens = memoryview(tokens).toreadonly()
+        self.char_counts = memoryview(char_counts).toreadonly()
+
+    def __getstate__(self):
+        # Memoryviews cannot be pickled: send the arrays behind them instead
+        return {
+            name: array(value.format, value.tobytes()) if isinstance(value, memoryview) else value
+            for name, value in self.__dict__.items()
+        }
+
+    def __setstate__(self, state):
+        self.__dict__.update({
+            name: memoryview(value).toreadonly() if isinstance(value, array) else value
+            for name, value in state.items()
+        })
+
+    def __len__(self):
+        """Number of distinct words."""
+        return len(self.frequencies)
+
+    def fingerprint(self):
+        """
+        :return: Hex digest identifying the alphabet, the word types and the running text.
+        """
+        digest = hashlib.sha256()
+        digest.update(''.join(self.alphabet.chars).encode("UTF-8"))
+        digest.update(self.buffer)
+        digest.update(self.offsets.tobytes())
+        digest.update(self.tokens.tobytes())
+        return digest.hexdigest()
+
+    def word_key(self, type_id):
+        """
+        :param type_id: Word type id.
+        :return: Encoded word, as bytes.
+        """
+        width = self.alphabet.width
+        return self.buffer[self.offsets[type_id] * width:self.offsets[type_id + 1] * width]
+
+    def word_codes(self, type_id):
+        """
+        :param type_id: Word type id.
+        :return: The word as a sequence of character codes.
+        """
+        return self.alphabet.code_sequence(self.word_key(type_id))
+
+    def word(self, type_id):
+        """
+        :param type_id: Word type id.
+        :return: The word as a string.
+        """
+        return self.alphabet.decode(self.word_key(type_id))
+
+
+class SegmentTable:
+    """
+    Interns encoded segments to dense integer ids, assigned in order of first appearance.
+    """
+
+    def __init__(self):
+        self.ids = {}
+        self.keys = []
+
+    def __len__(self):
+        return len(self.keys)
+
+    def intern(self, key):
+        """
+        :param key: Encoded segment.
+        :return: The id of the segment, creating it if needed.
+        """
+        segment_id = self.ids.get(key)
+        if segment_id is None:
+            segment_id = self.ids[key] = len(self.keys)
+            self.keys.append(key)
+        return segment_id
@@ -0,0 +1,147 @@
+import numpy as np
+
+# Number of set bits of every byte value, to count boundaries in packed bitmasks
+POPCOUNT = np.array([bin(byte).count("1") for byte in range(256)], dtype=np.int64)
+
+
+def segments_match(predicted, gold):
+    """
+    Exact-match rule of compare_segments, for a single pair of segmentations.
+
+    Parameters:
+    predicted (str): Predicted segmentation (BPE "@@" markers allowed).
+    gold (str): Linguist's segmentation, morphemes separated by spaces.
+
+    Returns:
+    bool: True if the segmentations are the same.
+    """
+    predicted_cleaned = predicted.strip().replace('@@ ', '').replace(' ', '')
+    gold_cleaned = gold.strip().replace(' ', '')
+    return predicted_cleaned == gold_cleaned and predicted.strip().replace('@@', ' ') == gold.strip()
+
+
+def encode_segmentations(segmentations):
+    """
+    Encode segmentations as boundary bitmasks over their unsegmented words, in one pass over the
+    concatenated text.
+
+    Parameters:
+    segmentations (list): Strings with the morphemes of a word separated by spaces, without newlines.
+
+    Returns:
+    tuple: (letters, lengths, boundaries, regular) where letters is a (lines x longest word) array of
+    the code points of each unsegmented word, zero-padded; lengths holds the length of each word;
+    boundaries is a boolean array of the same shape as letters, True where a morpheme other than the
+    first starts; and regular is False for the lines whose spacing a bitmask cannot represent
+    (leading, trailing or repeated spaces).
+    """
+    n_lines = len(segmentations)
+    codes = np.frombuffer("\n".join(segmentations).encode("utf-32-le"), dtype=np.uint32)
+    newline = codes == 10
+    space = codes == 32
+    letter = ~(newline | space)
+    line_of = np.cumsum(newline)
+
+    rows = line_of[letter]
+    lengths = np.bincount(rows, minlength=n_lines)
+    first_letter = np.cumsum(lengths) - lengths
+    columns = np.arange(len(rows)) - first_letter[rows]
+    width = int(lengths.max()) if n_lines else 0
+
+    letters = np.zeros((n_lines, width), dtype=np.uint32)
+    letters[rows, columns] = codes[letter]
+    follows_space = np.zeros(len(codes), dtype=bool)
+    follows_space[1:] = space[:-1]
+    boundaries = np.zeros((n_lines, width), dtype=bool)
+    boundaries[rows, columns] = follows_space[letter] & (columns > 0)
+
+    # A space is only a boundary between two letters
+    spaces = np.nonzero(space)[0]
+    padded = np.concatenate(([10], codes, [10]))
+    misplaced = np.isin(padded[spaces], (10, 32)) | np.isin(padded[spaces + 2], (10, 32))
+    regular = np.ones(n_lines, dtype=bool)
+    regular[line_of[spaces[misplaced]]] = False
+    return letters, lengths, boundaries, regular
+
+
+def evaluate_segmentations(predicted, gold):
+    """
+    Evaluate predicted segmentations against the linguist's, line by line, on boundary bitmasks.
+    Exact matches follow compare_segments (lines whose spacing a bitmask cannot represent are checked
+    with segments_match). Boundary precision/recall/F1 and morpheme recall are computed over the lines
+    whose unsegmented words agree; a gold morpheme is recalled if the prediction has a boundary at both
+    of its ends and none inside.
+
+    Parameters:
+    predicted (list): Predicted segmentations, one per line (BPE "@@" markers are read as boundaries).
+    gold (list): Linguist's segmentations, morphemes separated by spaces, paired with predicted by position.
+
+    Returns:
+    tuple: (scores, exact) where scores is a dictionary with the number of "lines" compared, of "aligned"
+    lines and of "exact_matches", and the percentages "exact_match" (over all predicted lines, as
+    calculate_coverage), "boundary_precision", "boundary_recall", "boundary_f1" and "morpheme_recall";
+    exact is a boolean array telling which lines match exactly.
+    """
+    n_lines = min(len(predicted), len(gold))
+    predicted_letters, predicted_lengths, predicted_boundaries, predicted_regular = encode_segmentations(
+        [segmentation.strip().replace('@@', ' ') for segmentation in predicted[:n_lines]]
+    )
+    gold_letters, gold_lengths, gold_boundaries, gold_regular = encode_segmentations(
+        [segmentation.strip() for segmentation in gold[:n_lines]]
+    )
+    width = max(predicted_letters.shape[1], gold_letters.shape[1])
+    predicted_letters, predicted_boundaries, gold_letters, gold_boundaries = (
+        np.pad(array, ((0, 0), (0, width - array.shape[1])))
+        for array in (predicted_letters, predicted_boundaries, gold_letters, gold_boundaries)
+    )
+
+    aligned = (predicted_lengths == gold_lengths) & np.all(predicted_letters == gold_letters, axis=1)
+    predicted_masks = np.packbits(predicted_boundaries, axis=1)
+    gold_masks = np.packbits(gold_boundaries, axis=1)
+    exact = aligned & np.all(predicted_masks == gold_masks, axis=1)
+    for line in np.nonzero(~(predicted_regular & gold_regular))[0]:
+        exact[line] = segments_match(predicted[line], gold[line])
+    for line, segmentation in enumerate(predicted[:n_lines]):
+        if '@@' in segmentation:
+            exact[line] = segments_match(segmentation, gold[line])
+
+    true_boundaries = int(POPCOUNT[(predicted_masks & gold_masks)[aligned]].sum())
+    n_predicted = int(POPCOUNT[predicted_masks[aligned]].sum())
+    n_gold = int(POPCOUNT[gold_masks[aligned]].sum())
+    precision = true_boundaries / n_predicted * 100 if n_predicted else 0.0
+    recall = true_boundaries / n_gold * 100 if n_gold else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+
+    # Boundaries with the word edges added, so that every morpheme lies between two set positions
+    rows = np.arange(int(aligned.sum()))
+    lengths = gold_lengths[aligned]
+    predicted_edges = np.zeros((len(rows), width + 1), dtype=bool)
+    predicted_edges[:, :width] = predicted_boundaries[aligned]
+    predicted_edges[:, 0] = True
+    predicted_edges[rows, lengths] = True
+    gold_edges = np.zeros((len(rows), width + 1), dtype=bool)
+    gold_edges[:, :width] = gold_boundaries[aligned]
+    gold_edges[:, 0] = True
+    gold_edges[rows, lengths] = True
+    edge_rows, edge_columns = np.nonzero(gold_edges)
+    in_word = edge_rows[:-1] == edge_rows[1:]
+    morpheme_rows, starts, ends = edge_rows[:-1][in_word], edge_columns[:-1][in_word], edge_columns[1:][in_word]
+    predicted_counts = np.cumsum(predicted_edges, axis=1)
+    recalled = (
+        predicted_edges[morpheme_rows, starts] & predicted_edges[morpheme_rows, ends]
+        & (predicted_counts[morpheme_rows, ends - 1] == predicted_counts[morpheme_rows, starts])
+    )
+    morpheme_recall = recalled.sum() / len(recalled) * 100 if len(recalled) else 0.0
+
+    exact_matches = int(exact.sum())
+    scores = {
+        "lines": n_lines,
+        "aligned": int(aligned.sum()),
+        "exact_matches": exact_matches,
+        "exact_match": exact_matches / len(predicted) * 100 if predicted else 0.0,
+        "boundary_precision": precision,
+        "boundary_recall": recall,
+        "boundary_f1": f1,
+        "morpheme_recall": float(morpheme_recall),
+    }
+    return scores, exact
@@ -1,9 +1,72 @@
 import os
+import shutil
+import logging
+import tempfile
 import matplotlib.pyplot as plt
 from math import log2
-from uchunker import UChunker
-from utils import words_from_file, words_from_file_regex
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from uchunker import UChunker, ENGINE_VERSION
+from utils import read_phrases, phrase_words, phrase_segmentations, write_lines
+from corpus_encoding import EncodedCorpus
 from comparison import compare_segmentations_to_file
+from evaluation import evaluate_segmentations
+from result_cache import ResultCache, file_digest
+
+# Identifies how cells are scored, as part of the result cache key
+EVALUATION_METHOD = "compare_segmentations_to_file+boundary_bitmask"
+SEARCH_MODES = ("grid", "halving")
+
+
+def run_cell(grammar, corpus, n_segments, iterations_grid, segmentations_path, details_dir, analysis_output,
+             log_output, trace_mode="off", trace_every=100, checkpoint_dir=None):
+    """
+    Runs one cell of the experiment grid: a single chunker for n_segments is trained up to the largest
+    iteration count and evaluated on the way. UChunker.start only runs the iterations it has not completed
+    yet, so each snapshot is the lexicon a cold run with that many iterations would produce.
+
+    :param grammar: Descriptive grammar file name.
+    :param corpus: EncodedCorpus of the grammar, shared by all its cells.
+    :param n_segments: Number of new segments per iteration.
+    :param iterations_grid: Increasing iteration counts at which the lexicon is evaluated.
+    :param segmentations_path: File with the linguist's segmentations of the grammar.
+    :param details_dir: Directory for the line-by-line comparison of each evaluation.
+    :param analysis_output: File the analysis trace is written to.
+    :param log_output: File the lexicon is written to after each iteration.
+    :param trace_mode: Analysis trace mode passed to the UChunker.
+    :param trace_every: Sampling interval used by the "sampled" trace mode.
+    :param checkpoint_dir: If given, training resumes from the latest checkpoint there and saves new ones.
+    :return: Dictionary mapping each iteration count to its scores: the "coverage" (%) of the lexicon, and
+        the evaluate_segmentations scores of the chunker's segmentation of each word.
+    """
+    cell_scores = {}
+    with open(segmentations_path, "r", encoding="utf-8") as segmentations_file:
+        gold_segmentations = [line.strip() for line in segmentations_file]
+    chunker = UChunker(corpus, analysis_output=analysis_output, log_output=log_output, trace_mode=trace_mode,
+                       trace_every=trace_every, checkpoint_dir=checkpoint_dir)
+    for iteration in iterations_grid:
+        logging.info(f"Running experiment for grammar: {grammar}, iterations: {iteration}, new segments: {n_segments}")
+        chunker.start(n_segments, iteration, resume=checkpoint_dir is not None)
+
+        details_path = os.path.join(
+            details_dir, f"{os.path.basename(grammar)}_{iteration}_iterations_{n_segments}_segments.txt"
+        )
+        best_matches, total_morphemes = compare_segmentations_to_file(
+            chunker.lexicon, segmentations_path, details_path
+        )
+        coverage = (best_matches / total_morphemes) * 100
+        segmentations = {}
+        for gold in gold_segmentations:
+            word = gold.replace(' ', '')
+            if word not in segmentations:
+                segmentations[word] = chunker.segmentation(word)
+        scores, _ = evaluate_segmentations(
+            [segmentations[gold.replace(' ', '')] for gold in gold_segmentations], gold_segmentations
+        )
+        cell_scores[iteration] = {"coverage": coverage, **scores}
+        logging.info(f"Coverage: {coverage:.2f}%, boundary F1: {scores['boundary_f1']:.2f}%")
+    chunker.close()
+    return cell_scores
+
 
 class Experiments:
     """
@@ -11,7 +74,8 @@ class Experiments:
     iterations, and numbers of new segments. It also plots the coverage results.
     """
 
-    def __init__(self, grammars, output_dir, max_iterations=16, max_segments=1024):
+    def __init__(self, grammars, output_dir, max_iterations=16, max_segments=1024, trace_mode="off", trace_every=100,
+                 workers=1, cache=None, search="grid", eta=2, checkpoints=False):
         """
         Initializes the Experiments object.
 
@@ -19,12 +83,36 @@ class Experiments:
         :param output_dir: The directory where output files will be saved.
         :param max_iterations: The maximum number of iterations (logarithmically spaced).
         :param max_segments: The maximum number of new segments (logarithmically spaced).
+        :param trace_mode: Analysis trace mode passed to each UChunker ("off", "buffered" or "sampled").
+        :param trace_every: Sampling interval used by the "sampled" trace mode.
+        :param workers: Number of processes the (grammar, new segments) cells are run on.
+        :param cache: Optional ResultCache; cells whose scores are all cached are not recomputed.
+        :param search: "grid" runs every cell of the grid; "halving" runs a successive-halving search
+            (see run_halving).
+        :param eta: In the "halving" search, only the best 1/eta settings are promoted at each rung.
+        :param checkpoints: If True, every cell saves a checkpoint after each iteration under
+            output_dir/checkpoints and resumes from them, so an interrupted run only retrains what it lost.
+            The checkpoints are kept after the run; without this option the "halving" search still uses them
+            between rungs, in a scratch directory of its own that it deletes when it is done.
         """
+        if search not in SEARCH_MODES:
+            raise ValueError(f"Unknown search mode: {search}. Choose one of {', '.join(SEARCH_MODES)}.")
         self.grammars = grammars
         self.output_dir = output_dir
         self.max_iterations = max_iterations
         self.max_segments = max_segments
+        self.trace_mode = trace_mode
+        self.trace_every = trace_every
+        self.workers = workers
+        self.cache = cache if cache is not None else ResultCache(None, enabled=False)
+        self.search = search
+        self.eta = eta
+        self.checkpoints = checkpoints
         self.results = {}
+        # Full scores (see run_cell) of each grammar, iteration count and number of new segments
+        self.scores = {}
+        # (grammar, n_segments, error) for every cell that raised
+        self.failures = []
 
         # Ensure the output directory exists
         if not os.path.exists(self.output_dir):
@@ -32,43 +120,249 @@ class Experiments:
 
     def run_experiments(self):
         """
-        Runs experiments for each grammar with varying iterations and new segments.
+        Runs experiments for each grammar with varying iterations and new segments, with the search
+        chosen at construction (run_grid or run_halving). Each grammar is parsed once and its encoded
+        corpus is shared by all its cells.
         """
+        self.iterations_grid = [2**i for i in range(int(log2(self.max_iterations)) + 1)]
+        self.segments_grid = [2**j for j in range(int(log2(self.max_segments)) + 1)]
+        self.details_dir = os.path.join(self.output_dir, "comparisons")
+        os.makedirs(self.details_dir, exist_ok=True)
+        # Each cell writes its own lexicon log and analysis trace, so concurrent cells never share a file
+        self.logs_dir = os.path.join(self.output_dir, "logs")
+        os.makedirs(self.logs_dir, exist_ok=True)
+
+        self.corpora = {}
+        self.segmentations = {}
+        self.digests = {}
+        self.corpus_sizes = {}
         for grammar in self.grammars:
-            print(f"Processing grammar: {grammar}")
-            self.results[grammar] = {}
-
-            
-            output_morphemes = words_from_file(grammar, os.path.join(self.output_dir, "morphemes_output.txt"))
-            output_segmentations = words_from_file_regex(grammar, os.path.join(self.output_dir, "segmentations_output.txt"))
-            print(f"Morphemes file saved as: {output_morphemes}")
-            print(f"Segmentations file saved as: {output_segmentations}")
-
-            output_filename = os.path.join(self.output_dir, f"compare_segmentations_{os.path.basename(grammar)}_results.txt")
-            with open(output_filename, "w", encoding="utf-8") as output_file:
-                for iteration in [2**i for i in range(int(log2(self.max_iterations)) + 1)]:
-                    self.results[grammar][iteration] = {}
-                    for n_segments in [2**j for j in range(int(log2(self.max_segments)) + 1)]:
-                        print(f"Running experiment for grammar: {grammar}, iterations: {iteration}, new segments: {n_segments}")
-
-                        # Create a new instance of the chunker for each round of n_segments
-                        chunker = UChunker(grammar)
-                        chunker.start(n_segments, iteration)
-
-                        best_matches, total_morphemes = compare_segmentations_to_file(
-                            chunker.lexicon, output_segmentations, output_filename
-                        )
-                        coverage = (best_matches / total_morphemes) * 100
-                        self.results[grammar][iteration][n_segments] = coverage
-                        print(f"Coverage: {coverage:.2f}%")
-                        output_file.write(f"Grammar: {grammar}, Iterations: {iteration}, New Segments: {n_segments}, Coverage: {coverage:.2f}%\n")
-
-                        # Clear chunker memory
-                        del chunker
+            logging.info(f"Processing grammar: {grammar}")
+            # The grammar is parsed once; its cells share the encoded corpus
+            name = os.path.basename(grammar)
+            phrases = read_phrases(grammar)
+            words = phrase_words(phrases)
+            self.corpora[grammar] = EncodedCorpus(words)
+            output_morphemes = os.path.join(self.output_dir, f"morphemes_output_{name}")
+            output_segmentations = os.path.join(self.output_dir, f"segmentations_output_{name}")
+            write_lines(output_morphemes, words)
+            write_lines(output_segmentations, phrase_segmentations(phrases))
+            logging.info(f"Morphemes file saved as: {output_morphemes}")
+            logging.info(f"Segmentations file saved as: {output_segmentations}")
+            self.segmentations[grammar] = output_segmentations
+            self.digests[grammar] = file_digest(grammar)
+            self.corpus_sizes[grammar] = sum(map(len, words))
+
+        if self.search == "halving":
+            self.run_halving()
+        else:
+            self.run_grid()
+
+        # Same grammar order whatever order the cells finished in
+        self.results = {grammar: self.results[grammar] for grammar in self.grammars}
+        self.scores = {grammar: self.scores[grammar] for grammar in self.grammars}
 
         # Ensure the results are returned as a dictionary
         return self.results
 
+    def run_grid(self):
+        """
+        Runs every (grammar, new segments) cell of the grid up to max_iterations. Each cell is independent.
+        With several workers the cells run on a process pool, largest first, and a grammar's results are
+        recorded as soon as all its cells are done; a cell that fails is reported and left out of the
+        results without stopping the sweep.
+        """
+        cell_results = {grammar: {} for grammar in self.grammars}
+        pending = {grammar: len(self.segments_grid) for grammar in self.grammars}
+
+        def collect(grammar, n_segments, run, cached=False):
+            self.collect_cell(cell_results, grammar, n_segments, run, cached)
+            pending[grammar] -= 1
+            if pending[grammar] == 0:
+                self.record_grammar(grammar, cell_results[grammar])
+
+        cells = []
+        for grammar in self.grammars:
+            for n_segments in self.segments_grid:
+                scores = self.cached_scores(grammar, n_segments, self.iterations_grid)
+                if scores is None:
+                    cells.append((
+                        self.cell_cost(grammar, n_segments, self.max_iterations), grammar, n_segments,
+                        self.cell_arguments(grammar, n_segments, self.iterations_grid,
+                                            self.checkpoint_dir(grammar, n_segments) if self.checkpoints else None),
+                    ))
+                else:
+                    logging.info(f"Using cached results for grammar: {grammar}, new segments: {n_segments}")
+                    collect(grammar, n_segments, lambda: scores, cached=True)
+        self.run_cells(cells, collect)
+
+    def run_halving(self):
+        """
+        Successive-halving search. Every number of new segments is trained for the first iteration count
+        of the grid and evaluated; only the best 1/eta by coverage are promoted and trained further, up to
+        the next iteration count, and so on until max_iterations. Promoted cells resume from the checkpoint
+        their last rung left, so no iteration is run twice. Only the cells actually run are recorded.
+        Without the checkpoints option, they are kept in a scratch directory deleted at the end, never in
+        the shared output_dir/checkpoints.
+        """
+        scratch_dir = None if self.checkpoints else tempfile.mkdtemp(prefix="halving_", dir=self.output_dir)
+        try:
+            self.run_rungs(scratch_dir)
+        finally:
+            if scratch_dir is not None:
+                shutil.rmtree(scratch_dir, ignore_errors=True)
+
+    def run_rungs(self, checkpoints_root=None):
+        """
+        Runs the rungs of the successive-halving search (see run_halving).
+
+        :param checkpoints_root: Directory of the cells' checkpoints; None for output_dir/checkpoints.
+        """
+        cell_results = {grammar: {} for grammar in self.grammars}
+        survivors = {grammar: list(self.segments_grid) for grammar in self.grammars}
+
+        def collect(grammar, n_segments, run, cached=False):
+            self.collect_cell(cell_results, grammar, n_segments, run, cached)
+
+        completed = 0
+        for rung, n_iterations in enumerate(self.iterations_grid):
+            cells = []
+            for grammar in self.grammars:
+                for n_segments in survivors[grammar]:
+                    scores = self.cached_scores(grammar, n_segments, [n_iterations])
+                    if scores is None:
+                        cells.append((
+                            self.cell_cost(grammar, n_segments, n_iterations - completed), grammar, n_segments,
+                            self.cell_arguments(grammar, n_segments, [n_iterations],
+                                                self.checkpoint_dir(grammar, n_segments, checkpoints_root)),
+                        ))
+                    else:
+                        logging.info(f"Using cached result for grammar: {grammar}, iterations: {n_iterations}, "
+                                     f"new segments: {n_segments}")
+                        collect(grammar, n_segments, lambda: scores, cached=True)
+            self.run_cells(cells, collect)
+            if rung == len(self.iterations_grid) - 1:
+                break
+
+            for grammar in self.grammars:
+                evaluated = [
+                    n_segments for n_segments in survivors[grammar]
+                    if n_iterations in cell_results[grammar].get(n_segments, {})
+                ]
+                evaluated.sort(key=lambda n_segments: -cell_results[grammar][n_segments][n_iterations]["coverage"])
+                survivors[grammar] = evaluated[:max(1, len(evaluated) // self.eta)]
+                logging.info(f"Promoting to {self.iterations_grid[rung + 1]} iterations for grammar: {grammar}, "
+                             f"new segments: {survivors[grammar]}")
+            completed = n_iterations
+
+        for grammar in self.grammars:
+            self.record_grammar(grammar, cell_results[grammar])
+
+    def checkpoint_dir(self, grammar, n_segments, root=None):
+        """
+        :param root: Directory holding the checkpoints of all cells; None for output_dir/checkpoints.
+        :return: Directory of the checkpoints of a cell.
+        """
+        if root is None:
+            root = os.path.join(self.output_dir, "checkpoints")
+        return os.path.join(root, f"{os.path.basename(grammar)}_{n_segments}_segments")
+
+    def cell_arguments(self, grammar, n_segments, iterations_grid, checkpoint_dir=None):
+        """
+        :return: The run_cell arguments of a cell evaluated at the given iteration counts.
+        """
+        cell_name = f"{os.path.basename(grammar)}_{n_segments}_segments"
+        return (grammar, self.corpora[grammar], n_segments, iterations_grid, self.segmentations[grammar],
+                self.details_dir, os.path.join(self.logs_dir, f"{cell_name}_analysis.txt"),
+                os.path.join(self.logs_dir, f"{cell_name}_lexicon.txt"), self.trace_mode, self.trace_every,
+                checkpoint_dir)
+
+    def cell_cost(self, grammar, n_segments, n_iterations):
+        """
+        :return: Estimate of the time a cell takes to train for n_iterations, used to schedule the largest first.
+        """
+        # Training time grows with the corpus and, more slowly, with the lexicon growth per iteration
+        return self.corpus_sizes[grammar] * (1 + log2(n_segments)) * n_iterations
+
+    def cache_key(self, grammar, n_segments, iteration):
+        return ResultCache.key(
+            kind="mdl", grammar=self.digests[grammar], n_segments=n_segments, iterations=iteration,
+            engine=ENGINE_VERSION, evaluation=EVALUATION_METHOD,
+        )
+
+    def cached_scores(self, grammar, n_segments, iterations_grid):
+        """
+        :return: Dictionary mapping each iteration count to its cached scores, or None unless all are cached.
+        """
+        scores = {
+            iteration: self.cache.get(self.cache_key(grammar, n_segments, iteration)) for iteration in iterations_grid
+        }
+        return None if None in scores.values() else scores
+
+    def collect_cell(self, cell_results, grammar, n_segments, run, cached=False):
+        """
+        Stores the scores of a finished cell in cell_results (and the cache, unless they came from it).
+        A cell that failed is reported and recorded in self.failures.
+
+        :param cell_results: Dictionary mapping each grammar to {n_segments: {iteration: scores}}.
+        :param run: Callable returning the cell's {iteration: scores}, or raising its error.
+        :param cached: True if the scores come from the cache.
+        """
+        try:
+            cell_scores = run()
+        except Exception as e:
+            logging.error(f"Experiment failed for grammar: {grammar}, new segments: {n_segments}: {e!r}")
+            self.failures.append((grammar, n_segments, repr(e)))
+            return
+        cell_results[grammar].setdefault(n_segments, {}).update(cell_scores)
+        if not cached:
+            for iteration, scores in cell_scores.items():
+                self.cache.put(self.cache_key(grammar, n_segments, iteration), scores)
+
+    def run_cells(self, cells, collect):
+        """
+        Runs cells with run_cell, on a process pool (largest first) if there are several workers.
+
+        :param cells: List of (cost estimate, grammar, n_segments, run_cell arguments).
+        :param collect: Called as collect(grammar, n_segments, run) as each cell finishes, where run()
+            returns the cell's scores or raises its error.
+        """
+        if self.workers > 1:
+            with ProcessPoolExecutor(max_workers=self.workers) as pool:
+                futures = {
+                    pool.submit(run_cell, *arguments): (grammar, n_segments)
+                    for _, grammar, n_segments, arguments in sorted(cells, key=lambda cell: -cell[0])
+                }
+                for future in as_completed(futures):
+                    collect(*futures[future], future.result)
+        else:
+            for _, grammar, n_segments, arguments in cells:
+                collect(grammar, n_segments, lambda: run_cell(*arguments))
+
+    def record_grammar(self, grammar, cell_results):
+        """
+        Stores the results of a grammar in self.results (coverages), self.scores and its results file,
+        in grid order. Cells that were not run (failed, or not promoted by the search) are left out.
+
+        :param grammar: Descriptive grammar file name.
+        :param cell_results: Dictionary mapping n_segments to the {iteration: scores} of its cell.
+        """
+        self.results[grammar] = {}
+        self.scores[grammar] = {}
+        output_filename = os.path.join(self.output_dir, f"compare_segmentations_{os.path.basename(grammar)}_results.txt")
+        with open(output_filename, "w", encoding="utf-8") as output_file:
+            for iteration in self.iterations_grid:
+                self.results[grammar][iteration] = {}
+                self.scores[grammar][iteration] = {}
+                for n_segments in self.segments_grid:
+                    scores = cell_results.get(n_segments, {}).get(iteration)
+                    if scores is None:
+                        continue
+                    coverage = scores["coverage"]
+                    self.results[grammar][iteration][n_segments] = coverage
+                    self.scores[grammar][iteration][n_segments] = scores
+                    output_file.write(f"Grammar: {grammar}, Iterations: {iteration}, New Segments: {n_segments}, Coverage: {coverage:.2f}%, Boundary F1: {scores['boundary_f1']:.2f}%\n")
+
     def plot_results(self):
         """
         Plots the coverage results for each grammar.
@@ -0,0 +1,63 @@
+class LexiconTrie:
+    """
+    Prefix trie over the segments of a lexicon. It lets the segmentation engine
+    enumerate, from a given start position, only the spans that are actual
+    lexicon entries instead of every possible substring.
+    Segments can be strings or sequences of character codes.
+    """
+
+    # Key under which a node stores the value of the segment that ends at it
+    END = None
+
+    def __init__(self, segments=()):
+        """
+        Initializes the trie with the provided segments.
+
+        :param segments: Iterable of segments to index; each one is its own value.
+        """
+        self.root = {}
+        self.max_length = 0
+        for segment in segments:
+            self.insert(segment)
+
+    def insert(self, segment, value=None):
+        """
+        Adds a segment to the trie.
+
+        :param segment: Segment to add.
+        :param value: Value returned by matches for this segment; defaults to the segment itself.
+        """
+        node = self.root
+        for char in segment:
+            child = node.get(char)
+            if child is None:
+                child = node[char] = {}
+            node = child
+        node[self.END] = segment if value is None else value
+        if len(segment) > self.max_length:
+            self.max_length = len(segment)
+
+    def __contains__(self, segment):
+        node = self.root
+        for char in segment:
+            node = node.get(char)
+            if node is None:
+                return False
+        return self.END in node
+
+    def matches(self, char_sequence, start):
+        """
+        Walks the trie along char_sequence from start.
+        :param char_sequence: Sequence being segmented.
+        :param start: Position where the spans begin.
+        :return: Generator of (end, value) for every lexicon entry char_sequence[start:end].
+        """
+        node = self.root
+        end_marker = self.END
+        for end in range(start + 1, len(char_sequence) + 1):
+            node = node.get(char_sequence[end - 1])
+            if node is None:
+                return
+            value = node.get(end_marker)
+            if value is not None:
+                yield end, value
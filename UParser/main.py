@@ -1,15 +1,22 @@
 import os
 import argparse
 import logging
-from utils import create_directories, words_from_file, words_from_file_regex, calculate_frequencies
-from preprocessing import preprocess_corpus
-from segmentation import train_bpe, apply_bpe, compare_segments, save_correct_segmentations
-from analysis import calculate_coverage, calculate_compression_ratio
+import contextlib
+from utils import create_directories, read_phrases, phrase_words, phrase_segmentations
+from preprocessing import preprocess_text
+from bpe_learner import learn_bpe, count_words
+from bpe_sweep import MergeSweep, ENGINE_VERSION
+from artifact_store import ArtifactWriter
+from analysis import calculate_compression_ratio
+from evaluation import evaluate_segmentations
 from visualization import plot_coverage_vs_merges, plot_compression_vs_coverage, plot_frequent_segments_vs_merges
 from uchunker import UChunker
-from experiments import Experiments
+from experiments import Experiments, SEARCH_MODES
+from analysis_trace import TRACE_MODES
+from result_cache import ResultCache, file_digest
 from art import text2art
 from collections import Counter 
+from concurrent.futures import ProcessPoolExecutor
 import matplotlib.pyplot as plt  
 from pic import print_centered_ascii_art, print_centered_text_art
 
@@ -39,6 +46,15 @@ def main():
     parser.add_argument('--dry-run', action='store_true', help="Show the operations that would be performed without executing them.")
     parser.add_argument('--output-dir', type=str, help="Directory for generated files. Press Enter to use the default './output'.")
     parser.add_argument('--algorithm', type=str, choices=['BPE', 'MDL', 'Both'], help="Select the algorithm: BPE, MDL, or Both.")
+    parser.add_argument('--trace', type=str, choices=TRACE_MODES, default='off', help="MDL analysis trace: off, buffered, or sampled.")
+    parser.add_argument('--trace-every', type=int, default=100, help="Record one analysis out of every N in the sampled trace mode.")
+    parser.add_argument('--workers', type=int, default=1, help="Number of processes for the MDL experiment grid.")
+    parser.add_argument('--jobs', type=int, default=1, help="Number of languages processed concurrently, each in its own process.")
+    parser.add_argument('--search', type=str, choices=SEARCH_MODES, default='grid', help="MDL search: full grid, or successive halving.")
+    parser.add_argument('--no-cache', action='store_true', help="Do not read or write the result cache.")
+    parser.add_argument('--refresh', action='store_true', help="Recompute all results and overwrite the cached ones.")
+    parser.add_argument('--checkpoints', action='store_true', help="Save a checkpoint after every MDL training iteration and resume interrupted runs from them.")
+    parser.add_argument('--save-artifacts', action='store_true', help="Write the files of every BPE step (merge operations, segmented corpus, frequencies and correct segmentations).")
     
     args = parser.parse_args()
 
@@ -88,17 +104,18 @@ def main():
     
     # Initialize results storage
     bpe_results, mdl_results = None, None
+    cache = ResultCache(os.path.join(args.output_dir, "cache"), enabled=not args.no_cache, refresh=args.refresh)
 
     # Run BPE Algorithm
     if args.algorithm in ['BPE', 'Both']:
         logging.info("Running BPE algorithm...")
-        bpe_results = run_bpe(args.folder, args.range, args.step, args.output_dir)
+        bpe_results = run_bpe(args.folder, args.range, args.step, args.output_dir, cache, args.save_artifacts, args.jobs)
         logging.info("BPE algorithm completed.")
 
     # Run MDL Algorithm
     if args.algorithm in ['MDL', 'Both']:
         logging.info("Running MDL algorithm...")
-        mdl_results = run_mdl(args.folder, args.output_dir)
+        mdl_results = run_mdl(args.folder, args.output_dir, args.trace, args.trace_every, args.workers, cache, args.search, args.jobs, args.checkpoints)
         logging.info("MDL algorithm completed.")
 
     # Compare results if both algorithms are selected
@@ -108,95 +125,145 @@ def main():
         else:
             logging.warning("One or both algorithm results are None, skipping comparison.")
 
-def run_bpe(folder_path, range_of_merges, step, output_dir):
-    init, final = map(int, range_of_merges.split('-'))
+def run_bpe(folder_path, range_of_merges, step, output_dir, cache=None, save_artifacts=False, jobs=1):
     bpe_results = {}
-    for filename in os.listdir(folder_path):
-        if filename.endswith(".txt"):
-            file_path = os.path.join(folder_path, filename)
-            language = os.path.splitext(filename)[0]
-            base_path = create_directories(language)
-
-            corpus_path = os.path.join(base_path, "corpus.txt")
-            segmented_path = os.path.join(base_path, "corpus_segmented.txt")
-
-            words = words_from_file(file_path, corpus_path)
-            words_from_file_regex(file_path, segmented_path)
-
-            original_vocab = Counter(words)
-            initial_vocab_size = len(original_vocab)
-            logging.info(f"Initial vocabulary size for {language}: {initial_vocab_size}")
-
-            coverage_data = []
-            compression_data = []
-            segment_data = []
-
-            for i in range(init, final + 1, step):
-                preprocess_corpus(corpus_path)
-                bpe_operations_path = os.path.join(base_path, "bpe_operations", f'bpe_operations_{i}_{language}.txt')
-                if not train_bpe(corpus_path, bpe_operations_path, i):
-                    continue
-
-                output_segmented_corpus_path = os.path.join(base_path, "segmented_corpus", f'segmented_corpus_{i}_{language}.txt')
-                if not apply_bpe(corpus_path, bpe_operations_path, output_segmented_corpus_path, i):
-                    continue
-
-                freqs = calculate_frequencies(output_segmented_corpus_path)
-                final_vocab_size = len(freqs)
-                logging.info(f"BPE merge operations: {i}")
-                logging.info(f"Final vocabulary size: {final_vocab_size}")
-
-                with open(f'{output_segmented_corpus_path}.freqs.txt', 'w', encoding='UTF-8') as freq_file:
-                    for word, count in freqs.items():
-                        freq_file.write(f'{word} {count}\n')
-
-                with open(output_segmented_corpus_path, 'r', encoding='UTF-8') as file:
-                    content = file.read().replace('@@ ', ' ')
-                with open(output_segmented_corpus_path, 'w', encoding='UTF-8') as file:
-                    file.write(content)
-
-                with open(segmented_path, 'r', encoding='UTF-8') as file:
-                    segmented_words = file.readlines()
-                with open(output_segmented_corpus_path, 'r', encoding='UTF-8') as file:
-                    bpe_segments = file.readlines()
-
-                correct_segmentations = compare_segments(bpe_segments, segmented_words)
-                coverage = calculate_coverage(bpe_segments, segmented_words)
-                compression = calculate_compression_ratio(initial_vocab_size, final_vocab_size)
-                
-                correct_segmentations_path = os.path.join(base_path, "correct_segmentations", f'correct_segmentations_{i}_{language}.txt')
-                save_correct_segmentations(correct_segmentations, correct_segmentations_path)
+    if cache is None:
+        cache = ResultCache(None, enabled=False)
+    file_paths = [os.path.join(folder_path, filename) for filename in os.listdir(folder_path) if filename.endswith(".txt")]
+    if jobs > 1:
+        # Each language writes to its own directory, so the languages run concurrently
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            futures = [
+                pool.submit(run_bpe_language, file_path, range_of_merges, step, output_dir, cache, save_artifacts,
+                            logging.getLogger().level)
+                for file_path in file_paths
+            ]
+            for future in futures:
+                language, coverages = future.result()
+                bpe_results[language] = coverages
+    else:
+        for file_path in file_paths:
+            language, coverages = run_bpe_language(file_path, range_of_merges, step, output_dir, cache, save_artifacts)
+            bpe_results[language] = coverages
+    return bpe_results
 
+def run_bpe_language(file_path, range_of_merges, step, output_dir, cache, save_artifacts=False, log_level=None):
+    """
+    Run the BPE merge sweep of one language, and write its plots and report.
+    If log_level is given (in a process of the --jobs pool), log records are prefixed with the language.
+    Returns the language and its coverage at the last step.
+    """
+    init, final = map(int, range_of_merges.split('-'))
+    language = os.path.splitext(os.path.basename(file_path))[0]
+    if log_level is not None:
+        prefix_logging(language, log_level)
+    base_path = create_directories(language)
+
+    # The corpus and the linguist's segmentations are read and preprocessed once; every step
+    # works on them in memory
+    phrases = read_phrases(file_path)
+    words = phrase_words(phrases)
+    segmented_words = [f"{segmentation}\n" for segmentation in phrase_segmentations(phrases)]
+    corpus_lines = preprocess_text("".join(f"{word}\n" for word in words)).splitlines(keepends=True)
+
+    digest = file_digest(file_path)
+    original_vocab = Counter(words)
+    initial_vocab_size = len(original_vocab)
+    logging.info(f"Initial vocabulary size for {language}: {initial_vocab_size}")
+
+    coverage_data = []
+    compression_data = []
+    boundary_data = []
+    segment_data = []
+    # Merges are learned once, up to the largest count, and each step reads its segmentation
+    # off a single replay of them over the corpus word types
+    merges = None
+    sweep = None
+    artifacts_path = os.path.join(base_path, f'bpe_artifacts_{language}.bin')
+    writer = contextlib.nullcontext()
+    if save_artifacts:
+        # The store holds every requested step, so cached results are not used and the sweep is always built
+        merges = learn_bpe(count_words(corpus_lines), final)
+        sweep = MergeSweep(merges, corpus_lines)
+        writer = ArtifactWriter(artifacts_path, merges, corpus_lines, segmented_words)
+
+    # The store only replaces the previous one if the sweep completes (see ArtifactWriter)
+    with writer as artifacts:
+        for i in range(init, final + 1, step):
+            cache_key = ResultCache.key(kind="bpe", grammar=digest, num_merges=i, engine=ENGINE_VERSION,
+                                        evaluation="boundary_bitmask")
+            cached = cache.get(cache_key) if artifacts is None else None
+            if cached is not None:
+                coverage, compression = cached["coverage"], cached["compression"]
+                logging.info(f"BPE merge operations: {i} (cached)")
+                logging.info(f"Final vocabulary size: {cached['final_vocab_size']}")
                 logging.info(f'Coverage: {coverage:.2f}%')
                 logging.info(f'Compression: {compression:.2f}%')
-                logging.info(f'Correct segmentations saved to {correct_segmentations_path}')
-
+                log_boundary_scores(cached["scores"])
                 coverage_data.append((i, coverage))
                 compression_data.append((compression, coverage))
-                segment_data.extend([(word, i) for word, count in freqs.most_common(10)])
-
-            plot_coverage_vs_merges(coverage_data, language)
-            plot_compression_vs_coverage(compression_data, language)
-            plot_frequent_segments_vs_merges(segment_data, language)
-
-            report_path = os.path.join(output_dir, f'{language}_bpe_report.txt')
-            with open(report_path, 'w', encoding='UTF-8') as report_file:
-                report_file.write("Relatório de Segmentação Morfológica usando BPE\n")
-                report_file.write(f"Linguagem: {language}\n")
-                report_file.write(f"Intervalo de merges: {init}-{final}\n")
-                report_file.write(f"Diretório de saída: {output_dir}\n")
-                report_file.write("Coberturas:\n")
-                for merge, coverage in coverage_data:
-                    report_file.write(f"{merge} merges: {coverage:.2f}% cobertura\n")
-            logging.info(f'Relatório BPE salvo em {report_path}')
-
-            # Store the coverage data in memory
-            if language not in bpe_results:
-                bpe_results[language] = {}
-            bpe_results[language][i] = coverage
-    return bpe_results
+                boundary_data.append((i, cached["scores"]["boundary_f1"]))
+                segment_data.extend([(word, i) for word, count in cached["frequent_segments"]])
+                continue
+
+            if sweep is None:
+                merges = learn_bpe(count_words(corpus_lines), final)
+                sweep = MergeSweep(merges, corpus_lines)
+
+            segmented_lines, freqs = sweep.snapshot(i)
+            final_vocab_size = len(freqs)
+            logging.info(f"BPE merge operations: {i}")
+            logging.info(f"Final vocabulary size: {final_vocab_size}")
+
+            bpe_segments = [line.replace('@@ ', ' ') for line in segmented_lines]
+            scores, exact = evaluate_segmentations(bpe_segments, segmented_words)
+            coverage = scores["exact_match"]
+            compression = calculate_compression_ratio(initial_vocab_size, final_vocab_size)
+
+            logging.info(f'Coverage: {coverage:.2f}%')
+            logging.info(f'Compression: {compression:.2f}%')
+            log_boundary_scores(scores)
+            if artifacts is not None:
+                artifacts.add_step(i, segmented_lines, exact)
+
+            coverage_data.append((i, coverage))
+            compression_data.append((compression, coverage))
+            boundary_data.append((i, scores["boundary_f1"]))
+            segment_data.extend([(word, i) for word, count in freqs.most_common(10)])
+            cache.put(cache_key, {"coverage": coverage, "compression": compression,
+                                  "final_vocab_size": final_vocab_size, "scores": scores,
+                                  "frequent_segments": freqs.most_common(10)})
+
+    if save_artifacts:
+        logging.info(f'BPE artifacts saved to {artifacts_path}')
+
+    plot_coverage_vs_merges(coverage_data, language)
+    plot_compression_vs_coverage(compression_data, language)
+    plot_frequent_segments_vs_merges(segment_data, language)
+
+    report_path = os.path.join(output_dir, f'{language}_bpe_report.txt')
+    with open(report_path, 'w', encoding='UTF-8') as report_file:
+        report_file.write("Relatório de Segmentação Morfológica usando BPE\n")
+        report_file.write(f"Linguagem: {language}\n")
+        report_file.write(f"Intervalo de merges: {init}-{final}\n")
+        report_file.write(f"Diretório de saída: {output_dir}\n")
+        report_file.write("Coberturas:\n")
+        for (merge, coverage), (_, boundary_f1) in zip(coverage_data, boundary_data):
+            report_file.write(f"{merge} merges: {coverage:.2f}% cobertura, F1 de fronteiras: {boundary_f1:.2f}%\n")
+    logging.info(f'Relatório BPE salvo em {report_path}')
+
+    return language, {i: coverage}
+
+def log_boundary_scores(scores):
+    """
+    Log the boundary and morpheme scores returned by evaluate_segmentations.
+    """
+    logging.info(f'Boundary precision: {scores["boundary_precision"]:.2f}%, '
+                 f'recall: {scores["boundary_recall"]:.2f}%, F1: {scores["boundary_f1"]:.2f}%')
+    logging.info(f'Morpheme recall: {scores["morpheme_recall"]:.2f}%')
 
-def run_mdl(folder_path, output_dir):
+def run_mdl(folder_path, output_dir, trace_mode="off", trace_every=100, workers=1, cache=None, search="grid", jobs=1,
+            checkpoints=False):
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
@@ -207,10 +274,23 @@ def run_mdl(folder_path, output_dir):
         logging.info("No grammar files found in the specified folder for MDL.")
         return mdl_results  # Return an empty dictionary if no grammar files are found
 
-    experiments = Experiments(grammars, output_dir=output_dir)
-    
-    # Run experiments on all grammars at once
-    mdl_results = experiments.run_experiments()
+    if jobs > 1:
+        # One Experiments per grammar, each in a process of the pool, where it also plots its results
+        experiments = None
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            futures = [
+                pool.submit(run_mdl_language, grammar, output_dir, trace_mode, trace_every, workers, cache, search,
+                            checkpoints, logging.getLogger().level)
+                for grammar in grammars
+            ]
+            for future in futures:
+                mdl_results.update(future.result())
+    else:
+        experiments = Experiments(grammars, output_dir=output_dir, trace_mode=trace_mode, trace_every=trace_every,
+                                  workers=workers, cache=cache, search=search, checkpoints=checkpoints)
+
+        # Run experiments on all grammars at once
+        mdl_results = experiments.run_experiments()
     
     
     logging.debug(f"MDL results structure: {type(mdl_results)}")
@@ -227,11 +307,33 @@ def run_mdl(folder_path, output_dir):
         return {}
 
     
-    experiments.plot_results()
+    if experiments is not None:
+        experiments.plot_results()
     
     logging.info("Experimentos com MDL concluídos.")
     return mdl_results
 
+def run_mdl_language(grammar, output_dir, trace_mode, trace_every, workers, cache, search, checkpoints, log_level):
+    """
+    Run the MDL experiments of one grammar in a process of the --jobs pool, and plot its results.
+    """
+    prefix_logging(os.path.splitext(os.path.basename(grammar))[0], log_level)
+    experiments = Experiments([grammar], output_dir=output_dir, trace_mode=trace_mode, trace_every=trace_every,
+                              workers=workers, cache=cache, search=search, checkpoints=checkpoints)
+    mdl_results = experiments.run_experiments()
+    if mdl_results:
+        experiments.plot_results()
+    return mdl_results
+
+def prefix_logging(language, log_level):
+    """
+    Prefix the log records of this process with the language it works on. Processes started without
+    the parent's logging configuration are configured with its level.
+    """
+    logging.basicConfig(level=log_level)
+    for handler in logging.getLogger().handlers:
+        handler.setFormatter(logging.Formatter(f"%(levelname)s:%(name)s:[{language}] %(message)s"))
+
 
 
 def compare_algorithms(bpe_results, mdl_results, output_dir):
@@ -1,6 +1,19 @@
 # preprocessing.py
 import re
 
+def preprocess_text(content):
+    """
+    Remove punctuation from a text and convert it to lowercase.
+
+    Parameters:
+    content (str): The text to preprocess.
+
+    Returns:
+    str: The preprocessed text.
+    """
+    # Remove general punctuation marks and convert to lowercase
+    return re.sub(r'[.,"()?¿?¡!»«“”،/\\]', '', content).lower()
+
 def preprocess_corpus(corpus_path):
     """
     Preprocess the corpus by removing punctuation and converting to lowercase.
@@ -11,8 +24,7 @@ def preprocess_corpus(corpus_path):
     with open(corpus_path, 'r', encoding='UTF-8') as file:
         content = file.read()
 
-    # Remove general punctuation marks and convert to lowercase
-    content = re.sub(r'[.,"()?¿?¡!»«“”،/\\]', '', content).lower()
+    content = preprocess_text(content)
 
     with open(corpus_path, 'w', encoding='UTF-8') as file:
         file.write(content)
@@ -0,0 +1,147 @@
+import os
+import json
+import hashlib
+import tempfile
+
+
+def file_digest(path):
+    """
+    Compute the SHA-256 digest of a file's contents.
+
+    Parameters:
+    path (str): The file to hash.
+
+    Returns:
+    str: The hex digest.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    Persistent, content-addressed cache of experiment results. Entries are small JSON files named by
+    the hash of everything the result depends on (grammar contents, parameters, engine and evaluation
+    method), so a result is reused only when none of those changed. The least recently used entries
+    are evicted once the cache grows past max_bytes, down to three quarters of it. The size is measured
+    once, at the first put, and then kept up to date by each put; entries written by other processes
+    sharing the cache are counted at the next eviction.
+    """
+
+    def __init__(self, cache_dir, max_bytes=64 * 1024 * 1024, enabled=True, refresh=False):
+        """
+        :param cache_dir: Directory holding the entries.
+        :param max_bytes: Size bound of the cache on disk.
+        :param enabled: If False, nothing is read or written.
+        :param refresh: If True, existing entries are ignored and overwritten with fresh results.
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.refresh = refresh
+        self.hits = 0
+        self.misses = 0
+        # Bytes on disk, measured by the first put
+        self.size = None
+        if enabled:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key(**parts):
+        """
+        Builds the key of a result.
+        :param parts: JSON-serialisable values the result depends on.
+        :return: Hex digest identifying the result.
+        """
+        return hashlib.sha256(json.dumps(parts, sort_keys=True).encode("UTF-8")).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def get(self, key):
+        """
+        Looks a result up.
+        :param key: Key built by ResultCache.key.
+        :return: The cached value, or None on a miss (or when the cache is disabled or refreshing).
+        """
+        if not self.enabled or self.refresh:
+            return None
+        path = self.path(key)
+        try:
+            with open(path, "r", encoding="UTF-8") as file:
+                value = json.load(file)
+            # Touch the entry so that eviction is least-recently-used
+            os.utime(path)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """
+        Records a result, then evicts old entries if the cache went over its size bound.
+        :param key: Key built by ResultCache.key.
+        :param value: JSON-serialisable value.
+        """
+        if not self.enabled:
+            return
+        if self.size is None:
+            self.size = self.disk_size()
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            self.size -= os.stat(path).st_size
+        except FileNotFoundError:
+            pass
+        file_descriptor, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(file_descriptor, "w", encoding="UTF-8") as file:
+            json.dump(value, file)
+            size = file.tell()
+        os.replace(temp_path, path)
+        self.size += size
+        if self.size > self.max_bytes:
+            self.evict()
+
+    def entries(self):
+        """
+        :return: List of (modification time, size, path) of the entries on disk.
+        """
+        entries = []
+        for directory, _, filenames in os.walk(self.cache_dir):
+            for filename in filenames:
+                if filename.endswith(".json"):
+                    path = os.path.join(directory, filename)
+                    # Other processes sharing the cache may evict the same entries
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def disk_size(self):
+        """
+        :return: Total size of the entries on disk.
+        """
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        """
+        Deletes the least recently used entries until the cache fits in three quarters of max_bytes, so
+        that the next puts do not each trigger an eviction.
+        """
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes * 3 // 4:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        self.size = total
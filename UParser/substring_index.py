@@ -0,0 +1,55 @@
+class SubstringIndex:
+    """
+    Index from every character and character bigram of a set of encoded words to the words containing it.
+    It answers "which words contain this segment?" by scanning only the posting list of the
+    segment's rarest bigram instead of the whole word list.
+    """
+
+    def __init__(self, words, width=1):
+        """
+        Builds the index.
+
+        :param words: List of distinct encoded words (bytes); a word is referred to by its position in the list.
+        :param width: Number of bytes per character in the encoding.
+        """
+        self.words = words
+        self.width = width
+        self.postings = {}
+        for word_id, word in enumerate(words):
+            grams = set()
+            for start in range(0, len(word), width):
+                grams.add(word[start:start + width])
+                if start + 2 * width <= len(word):
+                    grams.add(word[start:start + 2 * width])
+            for gram in grams:
+                posting = self.postings.get(gram)
+                if posting is None:
+                    posting = self.postings[gram] = []
+                posting.append(word_id)
+
+    def contains(self, word, segment):
+        """
+        Tests whether a segment occurs in a word at a character boundary.
+        """
+        start = word.find(segment)
+        while start != -1 and start % self.width:
+            start = word.find(segment, start + 1)
+        return start != -1
+
+    def words_containing(self, segment):
+        """
+        Finds the indexed words that contain a segment.
+        :param segment: Non-empty encoded segment to look up.
+        :return: List of the ids of the words that contain the segment.
+        """
+        width = self.width
+        if len(segment) <= 2 * width:
+            return self.postings.get(segment, [])
+        shortest = None
+        for start in range(0, len(segment) - width, width):
+            posting = self.postings.get(segment[start:start + 2 * width])
+            if posting is None:
+                return []
+            if shortest is None or len(posting) < len(shortest):
+                shortest = posting
+        return [word_id for word_id in shortest if self.contains(self.words[word_id], segment)]
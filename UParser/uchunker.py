@@ -1,148 +1,609 @@
+import os
+import pickle
+import shutil
+import logging
+import tempfile
 from math import log2, inf
+from array import array
 from collections import Counter
-from utils import words_from_file, words_from_file_regex
+from concurrent.futures import ProcessPoolExecutor
+from utils import read_phrases, phrase_words
+from lexicon_trie import LexiconTrie
+from substring_index import SubstringIndex
+from analysis_trace import create_trace_sink
+from corpus_encoding import EncodedCorpus, SegmentTable
+from batched_segmentation import segment_words
+from checkpoint import checkpoint_path, latest_checkpoint, read_checkpoint, write_checkpoint
+
+ENGINES = ("scalar", "batched")
+# In incremental mode, once more than this fraction of the word types is affected by a lexicon update,
+# every analysis is dropped and the next pass re-parses the whole corpus
+FULL_PASS_FRACTION = 0.5
+# Version of the learning algorithm, part of the result cache key: bump it whenever a change
+# alters the lexicons UChunker learns (not for changes that only make it faster)
+ENGINE_VERSION = 1
+
+def segment_sequence(trie, segment_costs, code_sequence):
+    """
+    This function employs a forward-backward algorithm.
+    The forward step computes the optimal segmentation and associated costs for each prefix of the sequence.
+    Only spans that are lexicon entries are considered, found by walking the lexicon trie from each position;
+    any other span has infinite cost. A position no entry can reach falls back to its single character.
+    The backward step traces back from the end of the sequence to find the actual segmentation that yields the minimum cost.
+
+    :param trie: LexiconTrie over the character codes of the lexicon segments, holding segment ids.
+    :param segment_costs: Array mapping each segment id to its cost. The id of a single-character
+        segment must equal the character code, which is what the fallback relies on.
+    :param code_sequence: Sequence of character codes to analyze.
+    :return: Tuple containing the cost of the analysis and the list of segment ids.
+    """
+    length = len(code_sequence)
+    costs = [0] + [inf] * length
+    # Best analysis of each prefix: id and length of its last segment (single-character fallback by default)
+    last_segment = list(code_sequence)
+    last_segment.insert(0, None)
+    last_segment_length = [1] * (length + 1)
+
+    for initial_position in range(length):
+        prefix_cost = costs[initial_position]
+        if prefix_cost == inf:
+            continue
+        for final_position, segment_id in trie.matches(code_sequence, initial_position):
+            cost = segment_costs[segment_id] + prefix_cost
+            # Strict comparison keeps the earliest start on ties, as the exhaustive search did
+            if cost < costs[final_position]:
+                costs[final_position] = cost
+                last_segment[final_position] = segment_id
+                last_segment_length[final_position] = final_position - initial_position
+
+    final_segments = []
+    final_position = length
+    while final_position > 0:
+        final_segments.append(last_segment[final_position])
+        final_position -= last_segment_length[final_position]
+
+    cost_of_analysis = sum(segment_costs[segment_id] for segment_id in final_segments)
+
+    return cost_of_analysis, final_segments[::-1]
+
+
+# Lexicon of a worker process. The trie only grows: a segment that left the lexicon has an infinite
+# cost, which segment_sequence never picks, so its entry can stay
+worker_trie = None
+worker_segment_costs = None
+worker_version = 0
+worker_state_dir = None
+worker_typecode = None
+
+
+def lexicon_state_path(state_dir, version):
+    """
+    :return: Path of the file holding a lexicon state sent to the process pool (see UChunker.analyse_in_pool).
+    """
+    return os.path.join(state_dir, f"lexicon_{version:06d}.pkl")
+
+
+def init_worker(typecode, state_dir):
+    """
+    Process pool initializer: starts the worker with an empty lexicon.
+    :param typecode: Array typecode of the corpus encoding.
+    :param state_dir: Directory where the chunker writes its lexicon states.
+    """
+    global worker_trie, worker_segment_costs, worker_version, worker_state_dir, worker_typecode
+    worker_trie = LexiconTrie()
+    worker_segment_costs = None
+    worker_version = 0
+    worker_state_dir = state_dir
+    worker_typecode = typecode
+
+
+def update_worker(version):
+    """
+    Brings the worker's lexicon to a given state by reading the states it has not seen yet, each once.
+    Every state file holds (entries, segment_costs): the (segment id, encoded segment) pairs added to the
+    lexicon since the previous state, and the cost table of the state.
+    :param version: Number of the lexicon state.
+    """
+    global worker_segment_costs, worker_version
+    for state_version in range(worker_version + 1, version + 1):
+        with open(lexicon_state_path(worker_state_dir, state_version), "rb") as state_file:
+            entries, worker_segment_costs = pickle.load(state_file)
+        for segment_id, key in entries:
+            worker_trie.insert(memoryview(key).cast(worker_typecode), segment_id)
+    worker_version = max(worker_version, version)
+
+
+def analyse_words(version, word_keys):
+    """
+    Process pool task: analyses a shard of encoded words with the worker's lexicon.
+    :param version: Number of the lexicon state the words are analysed with (see update_worker).
+    :param word_keys: List of encoded words.
+    :return: List of (cost, segment ids) analyses, in the order of word_keys.
+    """
+    update_worker(version)
+    return [
+        segment_sequence(worker_trie, worker_segment_costs, memoryview(key).cast(worker_typecode))
+        for key in word_keys
+    ]
+
 
 class UChunker:
-    def __init__(self, filename, analysis_output="analysis.txt", log_output="log.txt"):
+    def __init__(self, filename, analysis_output="analysis.txt", log_output="log.txt",
+                 trace_mode="off", trace_every=100, trace_final_only=False, incremental=False,
+                 workers=1, engine="scalar", checkpoint_dir=None):
         """
         Initializes the UChunker with the provided filename and output files.
+        :param filename: Descriptive grammar file name, or an EncodedCorpus already built from it (the
+            corpus is only read, so one corpus can be shared by all the chunkers trained on a grammar).
+        The corpus is kept encoded (see corpus_encoding) and the lexicon as interned segment ids with
+        dense counts; strings are only materialised for output, e.g. by the lexicon property.
+        :param incremental: If True, analyses are kept across lexicon updates and only the words
+            affected by a change are re-parsed (see update_parses). new_lexicon recounts every segment,
+            so most updates affect nearly every word; the mode pays off when few counts change (small
+            lexicon updates on large corpora) and can otherwise be somewhat slower than full passes.
+        :param workers: Number of processes used to analyse the corpus. With more than one, each corpus
+            pass is sharded across a process pool that lives as long as the chunker (until close); each
+            worker reads the segments added to the lexicon and the new cost table once per pass.
+        :param engine: Segmentation engine for corpus passes: "scalar" (segment_sequence, the reference)
+            or "batched" (NumPy kernel over words grouped by length, see batched_segmentation).
+            Both give identical analyses; workers only applies to the scalar engine.
+        :param checkpoint_dir: If given, a checkpoint is saved there at the end of every iteration
+            (see save_checkpoint) and start(..., resume=True) continues from the latest one.
+        :param trace_mode: How analyses are traced to analysis_output: "off", "buffered" or "sampled".
+        :param trace_every: For the "sampled" mode, records one analysis out of every trace_every.
+        :param trace_final_only: For the "sampled" mode, only records the final iteration.
         """
-        # Utilize words_from_file from utils.py instead of ProcessDescriptiveGrammar
-        self.corpus = words_from_file(filename, "corpus_temp.txt")
-        self.char_set = set()
-        self.lexicon = Counter()
+        if isinstance(filename, EncodedCorpus):
+            self.corpus = filename
+        else:
+            self.corpus = EncodedCorpus(phrase_words(read_phrases(filename)))
+        self.alphabet = self.corpus.alphabet
+        self.char_set = set(self.alphabet.chars)
         self.analysis_output = analysis_output
         self.log_output = log_output
+        self.trace = create_trace_sink(trace_mode, analysis_output, every=trace_every, final_only=trace_final_only)
+        self.incremental = incremental
+        self.workers = workers
+        self.pool = None
+        # Directory of the lexicon states sent to the pool, the segments they hold and their number
+        self.pool_dir = None
+        self.pool_segment_ids = set()
+        self.pool_version = 0
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown engine: {engine}. Choose one of {', '.join(ENGINES)}.")
+        self.engine = engine
+        self.checkpoint_dir = checkpoint_dir
+        self.n_new_segments = None
+        # Word type id -> (cost, segment ids), valid for the current lexicon counts
+        self.parses = {}
+        # Fewest and most segments over all finite analyses of each word, filled lazily by update_parses
+        self.segment_bounds = {}
+        self.costed_counts = None
+        self.substring_index = None
+        if incremental:
+            word_keys = [self.corpus.word_key(type_id) for type_id in range(len(self.corpus))]
+            self.substring_index = SubstringIndex(word_keys, self.alphabet.width)
+
+        # Single characters are interned first, so the id of each character segment is its code
+        self.segments = SegmentTable()
+        for code in range(len(self.alphabet)):
+            self.segments.intern(self.alphabet.encode(self.alphabet.chars[code]))
 
-        for line in self.corpus:
-            chars = ''.join(line)
-            for c in chars:
-                self.lexicon[c] += 1
-            self.char_set |= set(chars)
-        
         self.char_cost = -1 * log2(1 / len(self.char_set))
+        self.reset_lexicon()
 
-    def start(self, n_new_segments, n_iterations):
+    @property
+    def lexicon(self):
+        """
+        The lexicon as a Counter of segment strings, in lexicon order.
+        """
+        decode = self.alphabet.decode
+        keys = self.segments.keys
+        return Counter({decode(keys[segment_id]): self.counts[segment_id] for segment_id in self.lexicon_ids})
+
+    def start(self, n_new_segments, n_iterations, resume=False, tolerance=None, window=1):
         """
         Starts the chunker process with specified segments and iterations.
+        Training runs until n_iterations iterations have been completed since the last reset, so
+        a chunker loaded from a checkpoint only runs the iterations that are still missing.
+        With a tolerance, training also stops early, before updating the lexicon, as soon as the
+        hypothesis cost goes up or has improved by less than tolerance (relative) in each of the
+        last window iterations (see stopping_reason).
+        :param resume: If True, first loads the latest checkpoint in self.checkpoint_dir that is ahead of the
+            chunker without going past n_iterations, if any.
+        :param tolerance: Minimum relative improvement of the hypothesis cost; None disables early stopping.
+        :param window: Number of consecutive iterations below tolerance needed to stop.
+        :return: Tuple (reason, iteration): why training stopped ("max_iterations", "converged" or
+            "cost_increased") and the iteration at which it did. Also kept in self.stop_reason and self.stopped_at.
         """
-        for i in range(n_iterations):
+        if resume and self.checkpoint_dir is not None:
+            path = latest_checkpoint(self.checkpoint_dir, self.iteration + 1, n_iterations)
+            if path is not None:
+                self.load_checkpoint(path, n_new_segments, n_iterations)
+        self.n_new_segments = n_new_segments
+        for i in range(self.iteration, n_iterations):
+            self.trace.start_iteration(i, i == n_iterations - 1)
             first_parse = self.new_segments_from_parse()
-            print(f"Iteração {i}")
-            print(f"Custo atual do léxico: {self.lexicon_cost()}")
-            print(f"Custo atual da análise: {first_parse[1]}")
-            print(f"Custo da hipótese: {self.lexicon_cost() + first_parse[1]}")
+            lexicon_cost = self.lexicon_cost()
+            logging.info(f"Iteração {i}")
+            logging.info(f"Custo atual do léxico: {lexicon_cost}")
+            logging.info(f"Custo atual da análise: {first_parse[1]}")
+            logging.info(f"Custo da hipótese: {lexicon_cost + first_parse[1]}")
+            # history[k] holds iteration k; drop what a previous, interrupted run left from here on
+            del self.history[i:]
+            self.history.append({
+                "iteration": i,
+                "lexicon_cost": lexicon_cost,
+                "parse_cost": first_parse[1],
+                "hypothesis_cost": lexicon_cost + first_parse[1],
+            })
+            if tolerance is not None:
+                reason = self.stopping_reason(tolerance, window)
+                if reason is not None:
+                    self.trace.flush()
+                    self.stop_reason, self.stopped_at = reason, i
+                    return reason, i
             self.new_lexicon(first_parse[0], n_new_segments)
+            self.iteration = i + 1
+            self.trace.flush()
+            if self.checkpoint_dir is not None:
+                self.save_checkpoint(checkpoint_path(self.checkpoint_dir, self.iteration))
+        self.stop_reason, self.stopped_at = "max_iterations", self.iteration
+        return self.stop_reason, self.stopped_at
+
+    def stopping_reason(self, tolerance, window=1):
+        """
+        Applies the stopping policy to the cost history.
+        :param tolerance: Minimum relative improvement of the hypothesis cost.
+        :param window: Number of consecutive iterations below tolerance needed to stop.
+        :return: "cost_increased" if the last iteration raised the hypothesis cost, "converged" if each
+            of the last window iterations improved it by less than tolerance, None otherwise.
+        """
+        costs = [entry["hypothesis_cost"] for entry in self.history]
+        if len(costs) >= 2 and costs[-1] > costs[-2]:
+            return "cost_increased"
+        if len(costs) <= window:
+            return None
+        for previous, current in zip(costs[-window - 1:-1], costs[-window:]):
+            if (previous - current) / previous >= tolerance:
+                return None
+        return "converged"
+
+    def save_checkpoint(self, path):
+        """
+        Saves the training state (lexicon counts, completed iterations, cost history and parameters)
+        as a compressed binary checkpoint, written atomically.
+        :param path: Destination path.
+        """
+        keys = self.segments.keys
+        write_checkpoint(path, {
+            "corpus": self.corpus.fingerprint(),
+            "iteration": self.iteration,
+            "lexicon": [(keys[segment_id], self.counts[segment_id]) for segment_id in self.lexicon_ids],
+            "history": self.history,
+            "parameters": {"n_new_segments": self.n_new_segments, "engine": self.engine},
+        })
+
+    def load_checkpoint(self, path, n_new_segments=None, n_iterations=None):
+        """
+        Restores the training state saved by save_checkpoint.
+        :param path: Checkpoint path.
+        :param n_new_segments: If given, the number of new segments per iteration the checkpoint must have been
+            trained with.
+        :param n_iterations: If given, the number of iterations the checkpoint must not have gone past.
+        """
+        state = read_checkpoint(path)
+        if state["corpus"] != self.corpus.fingerprint():
+            raise ValueError(f"The checkpoint {path} was saved for a different corpus.")
+        # The engines give identical analyses, so only the number of new segments has to match
+        saved_segments = state["parameters"]["n_new_segments"]
+        if n_new_segments is not None and saved_segments != n_new_segments:
+            raise ValueError(f"The checkpoint {path} was trained with {saved_segments} new segments per iteration, "
+                             f"not {n_new_segments}.")
+        if n_iterations is not None and state["iteration"] > n_iterations:
+            raise ValueError(f"The checkpoint {path} has {state['iteration']} completed iterations, more than the "
+                             f"{n_iterations} requested.")
+        self.set_lexicon({self.segments.intern(key): freq for key, freq in state["lexicon"]})
+        self.iteration = state["iteration"]
+        self.history = list(state["history"])
+        self.n_new_segments = saved_segments
+
+    def close(self):
+        """Closes the analysis trace and shuts the process pool down."""
+        self.trace.close()
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+            shutil.rmtree(self.pool_dir, ignore_errors=True)
 
     def reset_lexicon(self):
         """Resets the lexicon to its initial state."""
-        self.lexicon = Counter()
-        for line in self.corpus:
-            chars = ''.join(line)
-            for c in chars:
-                self.lexicon[c] += 1
+        self.iteration = 0
+        # Costs reported at each iteration since the last reset
+        self.history = []
+        self.stop_reason, self.stopped_at = None, None
+        self.set_lexicon({code: count for code, count in enumerate(self.corpus.char_counts) if count > 0})
+
+    def set_lexicon(self, segment_counts):
+        """
+        Replaces the lexicon.
+        :param segment_counts: Dictionary mapping segment ids to their counts, in lexicon order.
+        """
+        self.lexicon_ids = list(segment_counts)
+        self.counts = array('q', bytes(8 * len(self.segments)))
+        for segment_id, freq in segment_counts.items():
+            self.counts[segment_id] = freq
+        self.index_lexicon()
+
+    def index_lexicon(self):
+        """
+        Rebuilds the prefix trie and the cost table used by analyse. Must be called whenever the lexicon is replaced.
+        """
+        keys = self.segments.keys
+        code_sequence = self.alphabet.code_sequence
+        self.trie = LexiconTrie()
+        for segment_id in self.lexicon_ids:
+            if self.counts[segment_id] > 0:
+                self.trie.insert(code_sequence(keys[segment_id]), segment_id)
+        width = self.alphabet.width
+        self.lexicon_length = sum(len(keys[segment_id]) for segment_id in self.lexicon_ids) // width
+        self.update_costs()
+
+    def update_costs(self):
+        """
+        Recomputes the cached lexicon total and the cost (-log2 p) of every segment.
+        Must be called whenever the lexicon counts change.
+        """
+        old_counts, old_total = self.costed_counts, getattr(self, "total", None)
+        counts = self.counts
+        self.total = sum(counts[segment_id] for segment_id in self.lexicon_ids)
+        self.costed_counts = {
+            segment_id: counts[segment_id] for segment_id in self.lexicon_ids if counts[segment_id] > 0
+        }
+        self.segment_costs = array('d', [inf]) * len(self.segments)
+        for segment_id, freq in self.costed_counts.items():
+            self.segment_costs[segment_id] = -1 * log2(freq / self.total)
+        if self.incremental and old_counts is not None:
+            self.update_parses(old_counts, old_total)
+        else:
+            # Analyses are only valid for the counts they were computed with
+            self.parses = {}
+
+    def update_parses(self, old_counts, old_total):
+        """
+        Brings the cached analyses up to date after a change of the lexicon counts.
+        Words containing a segment whose count changed (including added and removed segments)
+        are dropped and will be re-parsed. Every other word only sees the total change, which adds
+        the same log2(new_total / old_total) to the cost of each of its segments: if the total grew
+        and its analysis already uses the fewest possible segments (or it shrank and the analysis
+        uses the most), the analysis is still optimal and is only re-costed.
+        Once more than FULL_PASS_FRACTION of the words are dropped, all of them are, without looking up
+        the remaining segments or computing any bounds. Changed segments are looked up shortest first,
+        since short segments occur in the most words and reach that point soonest.
+        :param old_counts: Segment counts the cached analyses were computed with.
+        :param old_total: Lexicon total the cached analyses were computed with.
+        """
+        new_counts = self.costed_counts
+        keys = self.segments.keys
+        changed = [
+            keys[segment_id] for segment_id in old_counts.keys() | new_counts.keys()
+            if old_counts.get(segment_id) != new_counts.get(segment_id)
+        ]
+        changed.sort(key=len)
+        dirty = set()
+        limit = FULL_PASS_FRACTION * len(self.corpus)
+        for key in changed:
+            dirty.update(self.substring_index.words_containing(key))
+            if len(dirty) > limit:
+                self.parses = {}
+                self.segment_bounds = {}
+                return
+
+        for type_id in dirty:
+            self.parses.pop(type_id, None)
+            self.segment_bounds.pop(type_id, None)
+        if self.total == old_total:
+            return
+
+        segment_costs = self.segment_costs
+        for type_id, (cost, parse) in list(self.parses.items()):
+            # Clean words contain the same lexicon entries as before, so their bounds stay valid
+            bounds = self.segment_bounds.get(type_id)
+            if bounds is None:
+                bounds = self.segment_bounds[type_id] = self.count_segment_bounds(self.corpus.word_codes(type_id))
+            fewest, most = bounds
+            if cost == inf or len(parse) != (fewest if self.total > old_total else most):
+                del self.parses[type_id]
+                continue
+            # Same summation order as analyse, so the cost is exactly what a re-parse would give
+            self.parses[type_id] = (sum(segment_costs[segment_id] for segment_id in reversed(parse)), parse)
+
+    def parse_corpus(self):
+        """
+        Analyses every distinct word of the corpus once for the current lexicon.
+        :return: Dictionary mapping each word type id to its (cost, segment ids) analysis.
+        """
+        pending = [type_id for type_id in range(len(self.corpus)) if type_id not in self.parses]
+        if self.engine == "batched":
+            analyses = segment_words(
+                self.trie, self.segment_costs, len(self.alphabet),
+                [self.corpus.word_codes(type_id) for type_id in pending]
+            )
+        elif self.workers > 1 and len(pending) > self.workers:
+            analyses = self.analyse_in_pool([self.corpus.word_key(type_id) for type_id in pending])
+        else:
+            analyses = [
+                segment_sequence(self.trie, self.segment_costs, self.corpus.word_codes(type_id))
+                for type_id in pending
+            ]
+        for type_id, analysis in zip(pending, analyses):
+            self.parses[type_id] = analysis
+            self.trace.record(self.segment_strings(reversed(analysis[1])))
+        return self.parses
+
+    def analyse_in_pool(self, word_keys):
+        """
+        Analyses encoded words on the chunker's process pool, started on first use. The lexicon state is
+        written once per call to a file of the pool's directory: the segments added since the previous
+        state and the cost table. The tasks only carry the state's number and a shard of words, and each
+        worker reads every state once (see update_worker). The shards are returned in order.
+        :param word_keys: List of encoded words.
+        :return: List of (cost, segment ids) analyses, in the order of word_keys.
+        """
+        if self.pool is None:
+            self.pool_dir = tempfile.mkdtemp(prefix="uchunker_pool_")
+            self.pool_segment_ids = set()
+            self.pool_version = 0
+            self.pool = ProcessPoolExecutor(max_workers=self.workers, initializer=init_worker,
+                                            initargs=(self.alphabet.typecode, self.pool_dir))
+        keys = self.segments.keys
+        entries = []
+        for segment_id in self.lexicon_ids:
+            if self.counts[segment_id] > 0 and segment_id not in self.pool_segment_ids:
+                self.pool_segment_ids.add(segment_id)
+                entries.append((segment_id, keys[segment_id]))
+        self.pool_version += 1
+        with open(lexicon_state_path(self.pool_dir, self.pool_version), "wb") as state_file:
+            pickle.dump((entries, self.segment_costs), state_file, protocol=pickle.HIGHEST_PROTOCOL)
+
+        n_shards = self.workers * 4
+        shard_size = -(-len(word_keys) // n_shards)
+        shards = [word_keys[i:i + shard_size] for i in range(0, len(word_keys), shard_size)]
+        analyses = []
+        for shard_analyses in self.pool.map(analyse_words, [self.pool_version] * len(shards), shards):
+            analyses.extend(shard_analyses)
+        return analyses
+
+    def count_segment_bounds(self, code_sequence):
+        """
+        Computes the fewest and the most lexicon segments a complete analysis of a sequence can use.
+        :param code_sequence: Sequence of character codes to analyze.
+        :return: Tuple (fewest, most); (inf, -inf) if the lexicon cannot cover the sequence.
+        """
+        length = len(code_sequence)
+        fewest = [0] + [inf] * length
+        most = [0] + [-inf] * length
+        for initial_position in range(length):
+            if fewest[initial_position] == inf:
+                continue
+            for final_position, segment_id in self.trie.matches(code_sequence, initial_position):
+                fewest[final_position] = min(fewest[final_position], fewest[initial_position] + 1)
+                most[final_position] = max(most[final_position], most[initial_position] + 1)
+        return fewest[length], most[length]
 
     def new_segments_from_parse(self):
         """
         Parses the corpus to find new segments.
-        :return: New segments and their parse cost.
+        :return: New segments (a Counter keyed by encoded segment) and their parse cost.
         """
+        parses = self.parse_corpus()
+        keys = self.segments.keys
         new_segments = Counter()
-        parse_cost = 0
-        for line in self.corpus:
-            analysis_cost, parse = self.analyse(line)
-            parse_cost += analysis_cost
+        for type_id, word_freq in enumerate(self.corpus.frequencies):
+            parse = parses[type_id][1]
             for i in range(0, len(parse), 2):
                 if i == len(parse) - 1:
-                    new_segments[parse[i]] += 1
+                    new_segments[keys[parse[i]]] += word_freq
                 else:
-                    new_segments[parse[i] + parse[i + 1]] += 1
+                    new_segments[keys[parse[i]] + keys[parse[i + 1]]] += word_freq
+        # Summed token by token so the float total matches a per-token parse exactly
+        parse_cost = 0
+        for type_id in self.corpus.tokens:
+            parse_cost += parses[type_id][0]
         return new_segments, parse_cost
 
     def new_lexicon(self, new_segments, n_new_segments):
         """
         Updates the lexicon with new segments.
         """
-        new_segments_count = {}
-        for segment, freq in new_segments.most_common(n_new_segments):
-            new_segments_count[segment] = freq
-        for segment, freq in new_segments_count.items():
-            self.lexicon[segment] += freq
+        code_sequence = self.alphabet.code_sequence
+        for key, freq in new_segments.most_common(n_new_segments):
+            segment_id = self.segments.intern(key)
+            if segment_id >= len(self.counts):
+                self.counts.append(0)
+            if self.counts[segment_id] == 0:
+                self.lexicon_ids.append(segment_id)
+                self.lexicon_length += len(key) // self.alphabet.width
+                self.trie.insert(code_sequence(key), segment_id)
+            self.counts[segment_id] += freq
+        self.update_costs()
         with open(self.log_output, "w", encoding="UTF-8") as log_file:
             for segment, freq in self.lexicon.items():
                 log_file.write(f"{segment}: {freq}\n")
+        parses = self.parse_corpus()
         new_lexicon = Counter()
-        for line in self.corpus:
-            for segment in self.analyse(line)[1]:
-                new_lexicon[segment] += 1
-        self.lexicon = new_lexicon
+        for type_id, word_freq in enumerate(self.corpus.frequencies):
+            for segment_id in parses[type_id][1]:
+                new_lexicon[segment_id] += word_freq
+        self.set_lexicon(new_lexicon)
+
+    def segment_strings(self, segment_ids):
+        """
+        Materialises segments as strings.
+        :param segment_ids: Iterable of segment ids.
+        :return: Generator of the segment strings.
+        """
+        decode = self.alphabet.decode
+        keys = self.segments.keys
+        return (decode(keys[segment_id]) for segment_id in segment_ids)
 
     def item_cost(self, item):
         """
         Computes the cost of an item based on its probability in the lexicon.
-        :param item: Item to compute the cost for.
+        :param item: Item (segment string) to compute the cost for.
         :return: Cost of the item.
         """
-        prob = self.lexicon[item] / self.lexicon.total()
-        if prob == 0:
+        try:
+            segment_id = self.segments.ids.get(self.alphabet.encode(item))
+        except ValueError:
+            return inf
+        if segment_id is None:
             return inf
-        return -1 * log2(prob)
+        return self.segment_costs[segment_id]
 
     def analyse(self, char_sequence):
         """
-        This method employs a forward-backward algorithm.
-        The forward step computes the optimal segmentation and associated costs for each prefix of the sequence.
-        The backward step traces back from the end of the sequence to find the actual segmentation that yields the minimum cost.
+        Computes the optimal segmentation of a character sequence under the current lexicon
+        (see segment_sequence) and records it in the analysis trace.
 
-        :param char_sequence: Character sequence to analyze.
+        :param char_sequence: Character sequence to analyze; every character must be in the corpus alphabet.
         :type char_sequence: str
         :return: Tuple containing the cost of the analysis and the list of segments.
         :rtype: Tuple[float, List[str]]
         """
-        costs = [0]
-        segments = []
+        code_sequence = self.alphabet.code_sequence(self.alphabet.encode(char_sequence))
+        cost_of_analysis, segment_ids = segment_sequence(self.trie, self.segment_costs, code_sequence)
+        self.trace.record(self.segment_strings(reversed(segment_ids)))
+        return cost_of_analysis, list(self.segment_strings(segment_ids))
 
-        for final_position in range(1, len(char_sequence) + 1):
-            candidates = dict()
-            for initial_position in range(0, final_position):
-                current_sequence = char_sequence[initial_position:final_position]
-                candidates[current_sequence] = self.item_cost(current_sequence) + costs[initial_position]
-            chosen = min(candidates, key=candidates.get)
-
-            if candidates[chosen] == inf:
-                chosen = char_sequence[final_position - 1]
-
-            segments.append(chosen)
-            costs.append(candidates[chosen])
-
-        reversed_segments = list(reversed(segments))
-        final_segments = []
-        i = 0
-        while i < len(reversed_segments):
-            final_segments.append(reversed_segments[i])
-            segment_length = len(reversed_segments[i])
-            i += segment_length
-
-        cost_of_analysis = sum(map(self.item_cost, final_segments))
-
-        with open(self.analysis_output, "a", encoding="UTF-8") as analysis_file:
-            analysis_file.write(f"Análise: {' '.join(final_segments)}\n")
-
-        return cost_of_analysis, list(reversed(final_segments))
+    def segmentation(self, word):
+        """
+        Segments a word under the current lexicon, in the format of the linguist's segmentations.
+        Unlike analyse, it does not record anything in the analysis trace.
+        :param word: Word to segment; characters outside the corpus alphabet leave it unsegmented.
+        :return: The segments of the word, separated by spaces.
+        """
+        try:
+            code_sequence = self.alphabet.code_sequence(self.alphabet.encode(word))
+        except ValueError:
+            return word
+        _, segment_ids = segment_sequence(self.trie, self.segment_costs, code_sequence)
+        return ' '.join(self.segment_strings(segment_ids))
 
     def analysis_cost(self):
         """
         Computes the total cost of analysis.
         :return: Total analysis cost.
         """
-        return sum(map(lambda x: self.analyse(x)[0], self.corpus))
+        parses = self.parse_corpus()
+        return sum(map(lambda x: parses[x][0], self.corpus.tokens))
 
     def lexicon_cost(self):
         """
-        Computes the total cost of the lexicon.
+        Computes the total cost of the lexicon from the running total length of its segments.
         :return: Total lexicon cost.
         """
-        return sum(map(lambda x: len(x) * self.char_cost, self.lexicon.keys()))
+        return self.lexicon_length * self.char_cost
 
     def hypothesis_cost(self):
         """
@@ -3,20 +3,72 @@ import re
 
 def create_directories(language):
     """
-    Create necessary directories for storing intermediate files and results.
+    Create the directory of a language, where its plots and BPE artefacts are written. The
+    directories of the per-step files are only created when a step is exported (see ArtifactReader.export).
 
     Parameters:
-    language (str): The language for which directories are being created.
+    language (str): The language for which the directory is being created.
 
     Returns:
-    str: The base path where directories are created.
+    str: The base path of the language.
     """
     base_path = os.path.join(language)
-    os.makedirs(os.path.join(base_path, "bpe_operations"), exist_ok=True)
-    os.makedirs(os.path.join(base_path, "correct_segmentations"), exist_ok=True)
-    os.makedirs(os.path.join(base_path, "segmented_corpus"), exist_ok=True)
+    os.makedirs(base_path, exist_ok=True)
     return base_path
 
+def read_phrases(filename):
+    """
+    Read the segmented phrases of an interlinear grammar file (the first of every three lines).
+
+    Parameters:
+    filename (str): The grammar file to read.
+
+    Returns:
+    list: The phrases, with morphemes separated by hyphens.
+    """
+    with open(filename, "r", encoding="UTF-8") as file:
+        lines = file.readlines()
+    return [lines[i].strip() for i in range(0, len(lines), 3)]
+
+def phrase_words(phrases):
+    """
+    Extract the words of segmented phrases, with the morpheme boundaries removed.
+
+    Parameters:
+    phrases (list): Phrases returned by read_phrases.
+
+    Returns:
+    list: A list of words.
+    """
+    words = []
+    for phrase in phrases:
+        words.extend(phrase.replace('-', '').split())
+    return words
+
+def phrase_segmentations(phrases):
+    """
+    Extract the linguist's segmentation of each word of segmented phrases.
+
+    Parameters:
+    phrases (list): Phrases returned by read_phrases.
+
+    Returns:
+    list: One string per word, with its morphemes separated by spaces.
+    """
+    return [word.replace("-", " ") for phrase in phrases for word in re.findall(r"\S+", phrase)]
+
+def write_lines(path, lines):
+    """
+    Write one item per line to a file.
+
+    Parameters:
+    path (str): The output path.
+    lines (list): The items to write.
+    """
+    with open(path, "w", encoding="UTF-8") as output_file:
+        for line in lines:
+            output_file.write(f"{line}\n")
+
 def words_from_file(filename, corpus_path):
     """
     Extract words from the given file and write them to a corpus file.
@@ -28,15 +80,8 @@ def words_from_file(filename, corpus_path):
     Returns:
     list: A list of words extracted from the file.
     """
-    words = []
-    with open(filename, "r", encoding="UTF-8") as file:
-        lines = file.readlines()
-        for i in range(0, len(lines), 3):
-            phrase = lines[i].strip().replace('-', '').split()
-            words.extend(phrase)
-    with open(corpus_path, "w", encoding="UTF-8") as output_file:
-        for word in words:
-            output_file.write(word + "\n")
+    words = phrase_words(read_phrases(filename))
+    write_lines(corpus_path, words)
     return words
 
 def words_from_file_regex(filename, segmented_path):
@@ -50,14 +95,7 @@ def words_from_file_regex(filename, segmented_path):
     Returns:
     str: The path to the segmented file.
     """
-    with open(filename, "r", encoding="UTF-8") as file:
-        lines = file.readlines()
-        with open(segmented_path, "w", encoding="UTF-8") as output_file:
-            for i in range(0, len(lines), 3):
-                phrase = lines[i].strip()
-                for word in re.findall(r"\S+", phrase):
-                    word_without_hyphen = word.replace("-", " ")
-                    output_file.write(f"{word_without_hyphen}\n")
+    write_lines(segmented_path, phrase_segmentations(read_phrases(filename)))
     return segmented_path  # Ensure the path to the output file is returned
 
 def calculate_frequencies(tokenized_file):